@@ -0,0 +1,224 @@
+import asyncio
+import base64
+import json
+import os
+from datetime import datetime, timedelta
+
+import aiohttp
+
+from pybungie import BungieAPI
+
+from ErrorLog import error_log
+from Metrics import metrics
+from reset_calendar import utc_now
+
+TOKEN_URL: str = 'https://www.bungie.net/platform/app/oauth/token/'
+TOKENS_PATH: str = 'tokens.json'
+
+
+class AuthManager:
+    def __init__(self, api_key: str, client_id: str, client_secret: str, path: str = TOKENS_PATH,
+                 refresh_margin: timedelta = timedelta(minutes=5), xbox_live_email: str = None,
+                 xbox_live_password: str = None, token_url: str = TOKEN_URL, wait_timeout: float = 30):
+        """Keeps a valid OAuth2 access token for the Bungie.NET API without ever blocking the bot to log in
+
+        Tokens are kept in a file, so a restart picks up where the last run left off. A background task refreshes
+        the access token shortly before it expires, and any request that finds it expired anyway waits on that same
+        refresh. Only when there are no usable tokens at all does it log in with the Xbox Live credentials through
+        pybungie, on a worker thread.
+
+        :param api_key: The API key of your Bungie.NET application
+        :param client_id: The OAuth client id of your Bungie.NET application
+        :param client_secret: The OAuth client secret of your Bungie.NET application
+        :param path: Path of the file the tokens are kept in
+        :param refresh_margin: How long before the access token expires it is refreshed
+        :param xbox_live_email: (Optional) Used to log in when there are no tokens
+        :param xbox_live_password: (Optional) Used to log in when there are no tokens
+        :param token_url: Bungie.NET's token endpoint, only changed when talking to a stand-in server
+        :param wait_timeout: Seconds a process that doesn't renew the tokens itself waits for new ones in the file
+        """
+        self.api_key: str = api_key
+        self.client_id: str = client_id
+        self.client_secret: str = client_secret
+        self.path: str = path
+        self.refresh_margin: timedelta = refresh_margin
+        self.xbox_live_email: str = xbox_live_email
+        self.xbox_live_password: str = xbox_live_password
+        self.token_url: str = token_url
+        self.wait_timeout: float = wait_timeout
+        # whether this process refreshes and logs in, when several bot processes share the file only one of them does
+        self.renews: bool = True
+        self.tokens = None  # {'access_token', 'refresh_token', 'expires_at', 'refresh_expires_at'}
+        self._loading = None
+        self._refreshing = None
+        self._task = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.client_id and self.client_secret)
+
+    async def load(self):
+        """Reads the saved tokens, only the first call does any work
+        """
+        if self._loading is None:
+            self._loading = asyncio.get_event_loop().run_in_executor(None, self._read)
+        tokens: dict = await self._loading
+        if self.tokens is None and tokens is not None:
+            self.tokens = tokens
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                tokens: dict = json.load(f)
+            for key in ('expires_at', 'refresh_expires_at'):
+                tokens[key] = datetime.fromisoformat(tokens[key])
+            return tokens
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError) as e:
+            error_log.record('tokens_read', exc_info=e, Path=self.path)  # started over as if there were none
+            return None
+
+    def _write(self, tokens: dict):
+        temporary: str = self.path + '.tmp'
+        # the tokens grant access to the account, so only the bot's own user may read them
+        with open(os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            json.dump({key: value.isoformat() if isinstance(value, datetime) else value
+                       for key, value in tokens.items()}, f)
+        os.replace(temporary, self.path)
+
+    async def access_token(self):
+        """Returns a current access token, waiting on a refresh if the saved one has expired
+
+        :return: str or None if there are no tokens (yet)
+        """
+        if self.tokens is None:
+            await self.load()
+        if self.tokens is None:
+            return None
+        if utc_now() >= self.tokens['expires_at'] - timedelta(seconds=30):
+            try:
+                await self.refresh()
+            except Exception as e:  # the request is sent without a token, public endpoints still work
+                error_log.record('token_refresh', exc_info=e)
+                return None
+        return self.tokens['access_token']
+
+    async def refresh(self, rejected: str = None):
+        """Gets a new access token, joining the refresh that is already running if there is one
+
+        :param rejected: (Optional) The access token Bungie.NET just refused. If it has been replaced since, there
+            is nothing to do
+        """
+        if rejected is not None and self.tokens is not None and self.tokens['access_token'] != rejected:
+            return
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.ensure_future(self._refresh())
+        await asyncio.shield(self._refreshing)
+
+    async def _refresh(self):
+        await self.load()
+        now: datetime = utc_now()
+        saved: dict = await asyncio.get_event_loop().run_in_executor(None, self._read)
+        if saved is not None and (self.tokens is None or saved['expires_at'] > self.tokens['expires_at']) \
+                and now < saved['expires_at'] - timedelta(seconds=30):
+            self.tokens = saved  # another bot process sharing the file has refreshed them already
+            return
+        if not self.renews:
+            self.tokens = await self._wait_for_tokens()
+            return
+        if self.tokens is not None and now < self.tokens['refresh_expires_at']:
+            try:
+                with metrics.histogram('token_refresh_seconds', 'Time taken to refresh the access token').time():
+                    tokens: dict = await self._request_tokens(self.tokens['refresh_token'])
+            except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, ValueError) as e:
+                if not isinstance(e, aiohttp.ClientResponseError) or e.status != 400:
+                    raise
+                error_log.record('token_refresh', exc_info=e, Action='logging in again')  # 400 is an invalid_grant
+                tokens: dict = await self._log_in()
+        else:
+            tokens: dict = await self._log_in()
+        self.tokens = tokens
+        metrics.counter('token_refreshes_total', 'Access tokens obtained').inc()
+        await asyncio.get_event_loop().run_in_executor(None, self._write, tokens)
+
+    async def _wait_for_tokens(self) -> dict:
+        """Waits for the process that renews the tokens to write new ones to the file
+
+        :return: dict
+        """
+        loop = asyncio.get_event_loop()
+        current: str = self.tokens['access_token'] if self.tokens is not None else None
+        deadline: float = loop.time() + self.wait_timeout
+        while loop.time() < deadline:
+            await asyncio.sleep(1)
+            saved: dict = await loop.run_in_executor(None, self._read)
+            if saved is not None and saved['access_token'] != current \
+                    and utc_now() < saved['expires_at'] - timedelta(seconds=30):
+                return saved
+        raise RuntimeError(f'No new tokens were written to {self.path} within {self.wait_timeout} seconds')
+
+    async def _request_tokens(self, refresh_token: str) -> dict:
+        credentials: str = base64.b64encode(f'{self.client_id}:{self.client_secret}'.encode('ISO-8859-1')).decode()
+        headers: dict = {'Authorization': f'Basic {credentials}', 'X-API-Key': self.api_key}
+        data: dict = {'grant_type': 'refresh_token', 'refresh_token': refresh_token}
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=15)) as session:
+            async with session.post(self.token_url, headers=headers, data=data) as response:
+                response.raise_for_status()
+                body: dict = await response.json(content_type=None)
+        now: datetime = utc_now()
+        return {'access_token': body['access_token'], 'refresh_token': body['refresh_token'],
+                'expires_at': now + timedelta(seconds=body['expires_in']),
+                'refresh_expires_at': now + timedelta(seconds=body['refresh_expires_in'])}
+
+    async def _log_in(self) -> dict:
+        """Logs in through pybungie on a worker thread, then stops pybungie's own renewal thread since the tokens are
+        refreshed here from now on
+
+        :return: dict
+        """
+        if not (self.configured and self.xbox_live_email and self.xbox_live_password):
+            raise RuntimeError('There are no saved tokens and no Xbox Live credentials to log in with')
+
+        def log_in() -> dict:
+            # pybungie hands the tokens over in the environment and doesn't report a failed login, so clear out
+            # whatever an earlier login left there to tell the two apart
+            for name in ('ACCESS-TOKEN', 'REFRESH-TOKEN'):
+                os.environ.pop(name, None)
+            bungie_api: BungieAPI = BungieAPI(api_key=self.api_key)
+            bungie_api.input_xbox_credentials(xbox_live_email=self.xbox_live_email,
+                                              xbox_live_password=self.xbox_live_password)
+            bungie_api.start_oauth2(client_id=self.client_id, client_secret=self.client_secret)
+            bungie_api.close_oauth2()
+            if not (os.environ.get('ACCESS-TOKEN') and os.environ.get('REFRESH-TOKEN')):
+                raise RuntimeError('Logging in to Bungie.NET through pybungie did not produce any tokens')
+            now: datetime = utc_now()
+            # pybungie doesn't pass on the lifetimes, these are the ones Bungie.NET gives out
+            return {'access_token': os.environ['ACCESS-TOKEN'], 'refresh_token': os.environ['REFRESH-TOKEN'],
+                    'expires_at': now + timedelta(hours=1), 'refresh_expires_at': now + timedelta(days=90)}
+
+        print('Logging in to Bungie.NET')
+        return await asyncio.get_event_loop().run_in_executor(None, log_in)
+
+    async def keep_fresh(self):
+        """Refreshes the access token shortly before it expires, for as long as the bot runs
+        """
+        await self.load()
+        if self.tokens is None and not (self.xbox_live_email and self.xbox_live_password):
+            return  # nothing to refresh and no way to log in, only public endpoints will be used
+        while True:
+            if self.tokens is not None:
+                wait: float = (self.tokens['expires_at'] - self.refresh_margin - utc_now()).total_seconds()
+                await asyncio.sleep(max(0.0, wait))
+            try:
+                await self.refresh()
+            except Exception as e:  # requests fall back to refreshing on demand until this works again
+                error_log.record('token_refresh', exc_info=e)
+                await asyncio.sleep(60)
+
+    def start(self):
+        """Starts refreshing the access token in the background, does nothing if it is already running or the
+        application has no OAuth client configured
+        """
+        if self.configured and (self._task is None or self._task.done()):
+            self._task = asyncio.ensure_future(self.keep_fresh())
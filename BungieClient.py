@@ -0,0 +1,255 @@
+import asyncio
+import random
+import aiohttp
+
+from Metrics import metrics
+from RequestScheduler import Priority, RequestScheduler, RequestRejected, priority
+from pybungie import VendorHash, Components, MembershipType
+
+API_ROOT_PATH: str = 'https://www.bungie.net/Platform'
+SUCCESS: int = 1  # ErrorCode of a successful response
+SYSTEM_DISABLED: int = 5  # ErrorCode while Bungie.NET is down for maintenance, retrying won't help
+# ErrorStatus of responses refusing the access token, which a fresh token fixes
+TOKEN_REFUSED: tuple = ('WebAuthRequired', 'AccessTokenHasExpired', 'AuthorizationRecordExpired',
+                        'AuthorizationRecordRevoked')
+
+
+class BungieAPIError(Exception):
+    def __init__(self, message: str, error_code: int = None, error_status: str = None, status: int = None,
+                 throttle_seconds: int = 0):
+        """Raised when Bungie.NET can't be reached or answers with anything but success
+
+        :param message: The Message field of the response, or a description of what went wrong
+        :param error_code: The ErrorCode field of the response, if there was one
+        :param error_status: The ErrorStatus field of the response, if there was one
+        :param status: The HTTP status of the response, if there was one
+        :param throttle_seconds: How long Bungie.NET asked us to wait before trying again
+        """
+        super().__init__(message)
+        self.message: str = message
+        self.error_code: int = error_code
+        self.error_status: str = error_status
+        self.status: int = status
+        self.throttle_seconds: int = throttle_seconds
+
+
+class BungieClient:
+    def __init__(self, api_key: str, timeout: float = 10, pool_size: int = 20, root: str = API_ROOT_PATH,
+                 scheduler: RequestScheduler = None, retries: int = 3, max_backoff: float = 8, auth=None,
+                 deadline: float = 30):
+        """Asynchronous Bungie.NET API client, every request goes through one shared keep-alive connection pool
+
+        API requests wait for a turn from the scheduler, and are retried with exponential backoff when Bungie.NET
+        throttles them, fails with a server error or can't be reached.
+
+        :param api_key: The API key of your Bungie.NET application
+        :param timeout: Seconds a single request may take before it is abandoned
+        :param pool_size: Maximum number of simultaneous connections
+        :param root: Root path of the API, only changed when talking to a stand-in server
+        :param scheduler: (Optional) Rate limits the API requests, defaults to a RequestScheduler of its own
+        :param retries: How many times a failed API request is retried
+        :param max_backoff: The longest wait in seconds between two attempts of a request
+        :param auth: (Optional) AuthManager providing the access token, without one only public endpoints work
+        :param deadline: Seconds a request users are waiting on may take in all, waiting for turns and retries
+            included. Background requests have no deadline
+        """
+        self.api_key: str = api_key
+        self.root: str = root
+        self.timeout: aiohttp.ClientTimeout = aiohttp.ClientTimeout(total=timeout)
+        self.pool_size: int = pool_size
+        self.scheduler: RequestScheduler = scheduler or RequestScheduler()
+        self.retries: int = retries
+        self.max_backoff: float = max_backoff
+        self.auth = auth
+        self.deadline: float = deadline
+        self._session = None
+
+    def session(self) -> aiohttp.ClientSession:
+        """Returns the shared session, creating it on first use so it is bound to the running event loop
+
+        :return: aiohttp.ClientSession
+        """
+        if self._session is None or self._session.closed:
+            connector: aiohttp.TCPConnector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60,
+                                                                   ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def headers(self) -> dict:
+        headers: dict = {'X-API-Key': self.api_key}
+        access_token = await self.auth.access_token() if self.auth is not None else None
+        if access_token:
+            headers['Authorization'] = f'Bearer {access_token}'
+        return headers
+
+    async def fetch(self, url: str, headers: dict = None, source: str = 'external', raise_for_status: bool = False,
+                    timeout: float = None) -> (int, dict, dict):
+        """Requests a JSON document from any url using the shared session
+
+        :param url: The url to request
+        :param headers: (Optional) Headers to send along with the request
+        :param source: (Optional) Name the request is counted and timed under
+        :param raise_for_status: Whether an error status raises aiohttp.ClientResponseError
+        :param timeout: (Optional) Seconds this request may take, instead of the client's timeout
+        :return: (int, dict, dict) - The HTTP status, the response headers and the decoded body, None if the body
+            isn't JSON
+        """
+        status: str = 'error'
+        options: dict = {} if timeout is None else {'timeout': aiohttp.ClientTimeout(total=timeout)}
+        try:
+            with metrics.histogram('http_request_seconds', 'Duration of outgoing HTTP requests', source=source).time():
+                async with self.session().get(url, headers=headers, **options) as response:
+                    status = str(response.status)
+                    if raise_for_status:
+                        response.raise_for_status()
+                    try:
+                        body = await response.json(content_type=None)
+                    except ValueError:
+                        body = None
+                    return response.status, response.headers, body
+        finally:
+            metrics.counter('http_requests_total', 'Outgoing HTTP requests by response status', source=source,
+                            status=status).inc()
+
+    async def get_json(self, url: str, headers: dict = None, source: str = 'external') -> dict:
+        """Retrieves and decodes a JSON document from any url using the shared session
+
+        :param url: The url to request
+        :param headers: (Optional) Headers to send along with the request
+        :param source: (Optional) Name the request is counted and timed under
+        :return: dict
+        """
+        return (await self.fetch(url, headers=headers, source=source, raise_for_status=True))[2]
+
+    async def download(self, url: str, path: str, chunk_size: int = 1 << 20):
+        """Downloads a large file to path a chunk at a time, so it is never held in memory as a whole. The usual
+        per-request timeout does not apply
+
+        :param url: The url of the file
+        :param path: Where to write it
+        :param chunk_size: Most bytes written at once
+        """
+        loop = asyncio.get_event_loop()
+        with metrics.histogram('http_request_seconds', 'Duration of outgoing HTTP requests', source='download').time():
+            async with self.session().get(url, timeout=aiohttp.ClientTimeout(total=None, sock_read=60)) as response:
+                response.raise_for_status()
+                with open(path, 'wb') as f:
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        await loop.run_in_executor(None, f.write, chunk)
+
+    async def request(self, path: str, endpoint: str = 'other') -> dict:
+        """Requests an API path once the scheduler gives it a turn, retrying it while the failure is temporary
+
+        :param path: The path below the API root
+        :param endpoint: Name the request is counted and timed under
+        :return: dict - The Response field of the answer
+        :raise BungieAPIError: If the request fails for good, has to wait too long for a turn or, when a user is
+            waiting on it, isn't answered within the deadline
+        """
+        if priority.get() is not Priority.USER:
+            return await self._request(path, endpoint)
+        try:
+            return await asyncio.wait_for(self._request(path, endpoint), self.deadline)
+        except asyncio.TimeoutError as e:
+            metrics.counter('http_deadlines_exceeded_total', 'API requests abandoned at their deadline',
+                            source=f'bungie.{endpoint}').inc()
+            raise BungieAPIError(f'The request to {path} was not answered within {self.deadline} seconds',
+                                 error_status='deadline') from e
+
+    async def _request(self, path: str, endpoint: str) -> dict:
+        token_refreshed: bool = False
+        for attempt in range(self.retries + 1):
+            headers: dict = await self.headers()
+            try:
+                await self.scheduler.turn()
+            except RequestRejected as e:
+                raise BungieAPIError(f'The request to {path} was not sent: {e.reason}', error_status=e.reason) from e
+
+            delay: float = min(self.max_backoff, 0.5 * 2 ** attempt) * random.uniform(0.5, 1)
+            try:
+                status, _, json = await self.fetch(f'{self.root}{path}', headers=headers,
+                                                   source=f'bungie.{endpoint}')
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error: BungieAPIError = BungieAPIError(f'The request to {path} failed: {e!r}')
+            else:
+                json = json or {}
+                if status < 400 and json.get('ErrorCode') == SUCCESS:
+                    return json['Response']
+                error: BungieAPIError = BungieAPIError(json.get('Message', f'HTTP {status}'),
+                                                       error_code=json.get('ErrorCode'),
+                                                       error_status=json.get('ErrorStatus'), status=status,
+                                                       throttle_seconds=json.get('ThrottleSeconds') or 0)
+                if ((status == 401 or error.error_status in TOKEN_REFUSED) and self.auth is not None
+                        and not token_refreshed):  # every request refused the same token waits on one refresh
+                    token_refreshed = True
+                    rejected: str = headers.get('Authorization', '')[len('Bearer '):] or None
+                    try:
+                        await self.auth.refresh(rejected=rejected)
+                    except Exception as e:
+                        raise error from e
+                    continue
+                if error.throttle_seconds or status == 429:  # every request waits, not just this one
+                    delay = max(delay, error.throttle_seconds)
+                    self.scheduler.backoff(delay)
+                elif status < 500 or error.error_code == SYSTEM_DISABLED:
+                    raise error
+            if attempt < self.retries:
+                metrics.counter('http_retries_total', 'API requests retried', source=f'bungie.{endpoint}').inc()
+                await asyncio.sleep(delay)
+        raise error
+
+    async def get_vendor(self, membership_type: MembershipType, membership_id: int, character_id: int,
+                         vendor_hash: VendorHash, components: Components) -> dict:
+        """Get the details of a specific Vendor, see pybungie.BungieAPI.get_vendor
+
+        :return: dict
+        """
+        return await self.request(f'/Destiny2/{membership_type.value}/Profile/{membership_id}/Character/'
+                                  f'{character_id}/Vendors/{vendor_hash.value}/?components={components.value}',
+                                  endpoint='vendor')
+
+    async def get_vendors(self, membership_type: MembershipType, membership_id: int, character_id: int,
+                          components: Components) -> dict:
+        """Get every vendor with a rotating inventory for a character, see pybungie.BungieAPI.get_vendors
+
+        :return: dict
+        """
+        return await self.request(f'/Destiny2/{membership_type.value}/Profile/{membership_id}/Character/'
+                                  f'{character_id}/Vendors/?components={components.value}',
+                                  endpoint='vendors')
+
+    async def get_public_vendors(self, components: Components) -> dict:
+        """Returns information on the public vendors, see pybungie.BungieAPI.get_public_vendors
+
+        :return: dict
+        """
+        return await self.request(f'/Destiny2//Vendors/?components={components.value}', endpoint='public_vendors')
+
+    async def get_manifest(self) -> dict:
+        """Returns the current version of the manifest and the paths of its content databases
+
+        :return: dict
+        """
+        return await self.request('/Destiny2/Manifest/', endpoint='manifest')
+
+    async def manifest(self, entity_type: str, hash_identifier: int) -> dict:
+        """Manifests the specified entity, see pybungie.BungieAPI.manifest
+
+        :return: dict
+        """
+        return await self.request(f'/Destiny2/Manifest/{entity_type}/{hash_identifier}', endpoint='definition')
+
+    async def manifests(self, entity_type: str, hash_identifiers: list) -> dict:
+        """Manifests several entities of the same type concurrently
+
+        :param entity_type: See pybungie.Definitions
+        :param hash_identifiers: The hash identifiers of the entities you want returned
+        :return: dict - {hash_identifier: definition}
+        """
+        definitions: list = await asyncio.gather(*(self.manifest(entity_type, hash_identifier)
+                                                   for hash_identifier in hash_identifiers))
+        return dict(zip(hash_identifiers, definitions))
@@ -0,0 +1,235 @@
+import asyncio
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from Metrics import metrics
+
+DATABASE_PATH: str = 'destiny.db'
+
+# column order of each table, matching the INSERT statements the tables have always been written with
+TABLES: dict = {
+    'bounties': ('name', 'description', 'bountyType', 'hash'),
+    'items': ('name', 'type', 'hash', 'damageType', 'classType'),
+}
+
+HISTORY_COLUMNS: tuple = ('vendor', 'week', 'item_hash', 'name', 'item_type', 'class_type', 'seen_at')
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS bounties (name TEXT, description TEXT, bountyType TEXT, hash INTEGER PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS items (name TEXT, type TEXT, hash INTEGER PRIMARY KEY, damageType TEXT, classType TEXT);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY,
+    vendor INTEGER NOT NULL,
+    week TEXT NOT NULL,
+    item_hash INTEGER NOT NULL,
+    name TEXT NOT NULL COLLATE NOCASE,
+    item_type TEXT,
+    class_type TEXT,
+    seen_at TEXT NOT NULL,
+    UNIQUE (vendor, week, item_hash)
+);
+CREATE INDEX IF NOT EXISTS history_item ON history (item_hash, week);
+CREATE INDEX IF NOT EXISTS history_name ON history (name, week);
+CREATE INDEX IF NOT EXISTS history_vendor_week ON history (vendor, week);
+CREATE INDEX IF NOT EXISTS history_vendor_class ON history (vendor, class_type, week);
+"""
+
+
+class SerialDatabase:
+    def __init__(self, path: str, metric: str, description: str, **options):
+        """Owns one connection to a sqlite database in WAL mode
+
+        Every query runs on a single worker thread, which keeps sqlite off the event loop and serializes access to
+        the connection.
+
+        :param path: Path of the database file
+        :param metric: Name of the histogram the queries are timed under
+        :param description: Description of the histogram
+        :param options: Passed on to sqlite3.connect
+        """
+        self.path: str = path
+        self.metric: str = metric
+        self.description: str = description
+        self._options: dict = options
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1,
+                                                                thread_name_prefix=os.path.basename(path))
+        self._db = None
+
+    def prepare(self, db: sqlite3.Connection):
+        """Prepares a newly opened connection, e.g. creates the schema. Runs on the worker thread
+        """
+
+    def connection(self) -> sqlite3.Connection:
+        """Returns the connection, opening it and preparing it on first use. Only call from the worker thread
+
+        :return: sqlite3.Connection
+        """
+        if self._db is None:
+            db: sqlite3.Connection = sqlite3.connect(self.path, check_same_thread=False, **self._options)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self.prepare(db)
+            self._db = db
+        return self._db
+
+    async def run(self, function, *args):
+        """Runs function(connection, *args) on the worker thread, after every query queued before it, timing it under
+        the function's name
+
+        :return: Whatever function returns
+        """
+        histogram = metrics.histogram(self.metric, self.description, query=function.__name__.strip('_'))
+
+        def call():
+            with histogram.time():
+                return function(self.connection(), *args)
+        return await asyncio.get_event_loop().run_in_executor(self._executor, call)
+
+
+class DestinyDatabase(SerialDatabase):
+    def __init__(self, path: str = DATABASE_PATH):
+        """Owns the one connection to destiny.db
+
+        :param path: Path of the database file
+        """
+        super().__init__(path, 'sqlite_query_seconds', 'Time spent running destiny.db queries')
+
+    def prepare(self, db: sqlite3.Connection):
+        db.row_factory = sqlite3.Row
+        db.executescript(SCHEMA)
+        for table in TABLES:  # tables created before hash was a primary key need the duplicates removed first
+            db.execute(f'DELETE FROM {table} WHERE rowid NOT IN (SELECT MIN(rowid) FROM {table} GROUP BY hash)')
+            db.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {table}_hash ON {table} (hash)')
+        db.commit()
+
+    @staticmethod
+    def _select(db: sqlite3.Connection, table: str, hashes: list) -> dict:
+        if not hashes:
+            return {}
+        rows: list = db.execute(f'SELECT * FROM {table} WHERE hash IN ({",".join("?" * len(hashes))})',
+                                list(hashes)).fetchall()
+        return {row['hash']: dict(row) for row in rows}
+
+    @staticmethod
+    def _insert(db: sqlite3.Connection, table: str, rows: list):
+        columns: tuple = TABLES[table]
+        db.executemany(f'INSERT OR IGNORE INTO {table} VALUES ({", ".join(":" + column for column in columns)})', rows)
+        db.commit()
+
+    async def bounties(self, hashes: list) -> dict:
+        """Looks up every known bounty out of hashes in one query
+
+        :param hashes: The bounty hashes to look up
+        :return: dict - {hash: {'name': ..., 'description': ..., 'bountyType': ..., 'hash': ...}}
+        """
+        return await self.run(self._select, 'bounties', hashes)
+
+    async def save_bounties(self, bounties: list):
+        """Stores new bounties with a single commit
+
+        :param bounties: list of dicts shaped like the ones returned by bounties()
+        """
+        if bounties:
+            await self.run(self._insert, 'bounties', bounties)
+
+    async def items(self, hashes: list) -> dict:
+        """Looks up every known item out of hashes in one query
+
+        :param hashes: The item hashes to look up
+        :return: dict - {hash: {'name': ..., 'type': ..., 'hash': ..., 'damageType': ..., 'classType': ...}}
+        """
+        return await self.run(self._select, 'items', hashes)
+
+    async def save_items(self, items: list):
+        """Stores new items with a single commit
+
+        :param items: list of dicts shaped like the ones returned by items()
+        """
+        if items:
+            await self.run(self._insert, 'items', items)
+
+    @staticmethod
+    def _record(db: sqlite3.Connection, rows: list):
+        db.executemany(f'INSERT OR IGNORE INTO history ({", ".join(HISTORY_COLUMNS)}) '
+                       f'VALUES ({", ".join(":" + column for column in HISTORY_COLUMNS)})', rows)
+        db.commit()
+
+    async def record_history(self, rows: list):
+        """Appends what a vendor sold to the history, anything already recorded for the same vendor and week is
+        left as it was
+
+        :param rows: list of dicts with a key for each of HISTORY_COLUMNS
+        """
+        if rows:
+            await self.run(self._record, rows)
+
+    @staticmethod
+    def _matches(db: sqlite3.Connection, name: str) -> list:
+        # names are compared without case through the history_name index, whole names first, then prefixes
+        rows: list = db.execute('SELECT DISTINCT item_hash, name FROM history WHERE name = ?', (name,)).fetchall()
+        if not rows:
+            rows = db.execute('SELECT DISTINCT item_hash, name FROM history WHERE name >= ? AND name < ? LIMIT 25',
+                              (name, name + '\U0010ffff')).fetchall()
+        return [dict(row) for row in rows]
+
+    @classmethod
+    def _last_sold(cls, db: sqlite3.Connection, name: str, vendor: int) -> dict:
+        matches: list = cls._matches(db, name)
+        if not matches:
+            return None
+        hashes: list = [match['item_hash'] for match in matches]
+        vendor_filter: str = '' if vendor is None else 'AND vendor = ?'
+        row = db.execute(f'SELECT * FROM history WHERE item_hash IN ({",".join("?" * len(hashes))}) {vendor_filter} '
+                         f'ORDER BY week DESC LIMIT 1', hashes + ([] if vendor is None else [vendor])).fetchone()
+        return None if row is None else dict(row)
+
+    async def last_sold(self, name: str, vendor: int = None) -> dict:
+        """Finds the most recent week an item was sold
+
+        :param name: The item's name or the start of it, in any case
+        :param vendor: (Optional) Only look at what this vendor hash sold
+        :return: dict - the history row, or None if the item has never been recorded
+        """
+        return await self.run(self._last_sold, name, vendor)
+
+    @classmethod
+    def _appearances(cls, db: sqlite3.Connection, name: str, page: int, per_page: int) -> dict:
+        matches: list = cls._matches(db, name)
+        if not matches:
+            return None
+        item: dict = matches[0]  # an exact match, or the first of the items the name is the start of
+        total: int = db.execute('SELECT COUNT(*) FROM history WHERE item_hash = ?', (item['item_hash'],)).fetchone()[0]
+        rows: list = db.execute('SELECT * FROM history WHERE item_hash = ? ORDER BY week DESC LIMIT ? OFFSET ?',
+                                (item['item_hash'], per_page, (page - 1) * per_page)).fetchall()
+        return {'item': item, 'others': matches[1:], 'total': total, 'rows': [dict(row) for row in rows]}
+
+    async def appearances(self, name: str, page: int = 1, per_page: int = 10) -> dict:
+        """Lists every week an item was sold, most recent first, a page at a time
+
+        :param name: The item's name or the start of it, in any case
+        :param page: The page of weeks to return, starting at 1
+        :param per_page: Weeks per page
+        :return: dict - {'item': {'item_hash', 'name'}, 'others': [other matching items], 'total': int,
+            'rows': [history rows]}, or None if no item matches
+        """
+        return await self.run(self._appearances, name, page, per_page)
+
+    @staticmethod
+    def _sold_by(db: sqlite3.Connection, vendor: int, class_type: str, page: int, per_page: int) -> (int, list):
+        total: int = db.execute('SELECT COUNT(*) FROM history WHERE vendor = ? AND class_type = ?',
+                                (vendor, class_type)).fetchone()[0]
+        rows: list = db.execute('SELECT * FROM history WHERE vendor = ? AND class_type = ? ORDER BY week DESC '
+                                'LIMIT ? OFFSET ?', (vendor, class_type, per_page, (page - 1) * per_page)).fetchall()
+        return total, [dict(row) for row in rows]
+
+    async def sold_by(self, vendor: int, class_type: str, page: int = 1, per_page: int = 10) -> (int, list):
+        """Lists what a vendor sold for a class, most recent week first, a page at a time
+
+        :param vendor: The vendor's hash
+        :param class_type: A PlayerClass name, e.g. 'TITAN', or 'UNKNOWN' for items any class can use
+        :param page: The page of weeks to return, starting at 1
+        :param per_page: Rows per page
+        :return: (int, list) - the total number of rows and the rows of the page
+        """
+        return await self.run(self._sold_by, vendor, class_type, page, per_page)
@@ -0,0 +1,168 @@
+import atexit
+import os
+import queue
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+
+from Metrics import metrics
+
+load_dotenv()
+ERROR_LOG_PATH: str = 'err.log'
+
+
+class ErrorLog:
+    def __init__(self, path: str = ERROR_LOG_PATH, max_bytes: int = 1 << 20, rotate_every: timedelta = timedelta(days=1),
+                 backups: int = 5, flush_interval: float = 1, batch_size: int = 200,
+                 dedup_window: timedelta = timedelta(minutes=5), max_queue: int = 10000):
+        """Writes errors to err.log from a thread of its own, so recording one costs the event loop a queue put
+
+        Records are written in batches. A traceback already written within dedup_window is only counted, and the
+        count is written once the window is over. The log is rotated to err.log.1, err.log.2... once it grows past
+        max_bytes or has been written to for longer than rotate_every.
+
+        :param path: Path of the log
+        :param max_bytes: Size the log is rotated at
+        :param rotate_every: Age the log is rotated at
+        :param backups: Number of rotated logs kept
+        :param flush_interval: Seconds records may wait before they are written
+        :param batch_size: Most records written at once
+        :param dedup_window: How long a repeated traceback is only counted
+        :param max_queue: Records that may wait to be written, any more are dropped and counted
+        """
+        self.path: str = path
+        self.max_bytes: int = max_bytes
+        self.rotate_every: timedelta = rotate_every
+        self.backups: int = backups
+        self.flush_interval: float = flush_interval
+        self.batch_size: int = batch_size
+        self.dedup_window: float = dedup_window.total_seconds()
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._dropped: int = 0
+        self._seen: dict = {}  # {traceback key: [first seen, times repeated since]}, only touched by the writer
+        self._file = None
+        self._period_start: float = 0
+        self._thread = None
+        self._lock: threading.Lock = threading.Lock()
+
+    def record(self, event: str, exc_info: tuple = None, **context):
+        """Queues an error to be written
+
+        :param event: What was happening, e.g. the name of the discord event
+        :param exc_info: (Optional) The exception, or its (type, value, traceback) as from sys.exc_info()
+        :param context: Anything else worth writing down, e.g. Server=message.guild
+        """
+        if isinstance(exc_info, BaseException):
+            exc_info = (type(exc_info), exc_info, exc_info.__traceback__)
+        if self._thread is None:
+            self.start()
+        metrics.counter('errors_total', 'Errors recorded by event', event=event).inc()
+        try:
+            self._queue.put_nowait((time.time(), event, exc_info, context))
+        except queue.Full:
+            self._dropped += 1
+
+    def start(self):
+        """Starts the writer thread, does nothing if it is already running
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='err.log', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def close(self):
+        """Writes everything still queued and stops the writer thread
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        running: bool = True
+        while running:
+            batch: list = []
+            try:
+                batch.append(self._queue.get(timeout=self.flush_interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if None in batch:  # close() was called
+                running = False
+                batch.remove(None)
+            now: float = time.time()
+            text: str = ''.join(self._format(record) for record in batch) + self._repeats(now, flush=not running)
+            if self._dropped:
+                dropped, self._dropped = self._dropped, 0
+                text += f'\nWARNING on {_timestamp(now)}\n{dropped} errors were dropped, the log could not keep up\n'
+            if text:
+                try:
+                    self._write(text, now)
+                except OSError as e:  # nowhere left to report it but the console
+                    print(f'Could not write {self.path}: {e!r}')
+        if self._file is not None:
+            self._file.close()
+
+    def _format(self, record: tuple) -> str:
+        created, event, exc_info, context = record
+        frames: str = ''
+        key: tuple = (event,)
+        if exc_info is not None and exc_info[0] is not None:
+            stack = traceback.extract_tb(exc_info[2])
+            key = (event, exc_info[0].__name__) + tuple((frame.filename, frame.lineno) for frame in stack)
+            seen = self._seen.get(key)
+            if seen is not None and created - seen[0] < self.dedup_window:
+                seen[1] += 1
+                return ''
+            self._seen[key] = [created, 0]
+            frames = ''.join(traceback.format_exception(*exc_info))
+        details: str = ''.join(f'{name}: {value}\n' for name, value in context.items())
+        return f'\nERROR on {_timestamp(created)}\nEvent: {event}\n{details}{frames}'
+
+    def _repeats(self, now: float, flush: bool = False) -> str:
+        """Writes down how often each traceback repeated once its window is over
+
+        :return: str
+        """
+        text: str = ''
+        for key, (first, repeated) in list(self._seen.items()):
+            if flush or now - first >= self.dedup_window:
+                if repeated:
+                    text += (f'\nREPEATED on {_timestamp(now)}\nEvent: {key[0]}\n'
+                             f'{key[1]} happened {repeated} more times since {_timestamp(first)}\n')
+                del self._seen[key]
+        return text
+
+    def _write(self, text: str, now: float):
+        if self._file is None:
+            # a log left by an earlier run is as old as its last write
+            self._period_start = os.path.getmtime(self.path) if os.path.exists(self.path) else now
+            self._file = open(self.path, 'a')
+        if self._file.tell() >= self.max_bytes or now - self._period_start >= self.rotate_every.total_seconds():
+            self._rotate(now)
+        self._file.write(text)
+        self._file.flush()
+
+    def _rotate(self, now: float):
+        self._file.close()
+        for number in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{number}'):
+                os.replace(f'{self.path}.{number}', f'{self.path}.{number + 1}')
+        if self.backups:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'a')
+        self._period_start = now
+
+
+def _timestamp(moment: float) -> str:
+    return datetime.fromtimestamp(moment).strftime("%m/%d/%Y at %H:%M:%S")
+
+
+# every module records its failures here, the path is set per process when the bot runs as several
+error_log: ErrorLog = ErrorLog(path=os.getenv('ERROR_LOG_PATH', ERROR_LOG_PATH))
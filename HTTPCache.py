@@ -0,0 +1,146 @@
+import asyncio
+import re
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+
+from BungieClient import BungieClient
+from ErrorLog import error_log
+from Metrics import metrics
+from reset_calendar import utc_now
+
+MAX_AGE = re.compile(r'max-age=(\d+)')
+
+
+class HTTPCache:
+    def __init__(self, client: BungieClient, default_max_age: int = 300, revalidate_timeout: float = 3,
+                 retry_after: timedelta = timedelta(minutes=1), keep_for: timedelta = timedelta(days=7), store=None):
+        """Caches JSON documents from external sites the way a browser would
+
+        A document is reused without asking while Cache-Control's max-age allows. After that it is revalidated with
+        If-None-Match / If-Modified-Since, so an unchanged document costs a body-less 304. If the site fails or is
+        slower than revalidate_timeout, the last good copy is returned instead, and keeps being returned without
+        asking for retry_after so a site that is down doesn't slow down every request.
+
+        :param client: Client whose session the requests are sent with
+        :param default_max_age: Seconds a document without a max-age is reused before it is revalidated
+        :param revalidate_timeout: Seconds a revalidation may take before the cached copy is used instead
+        :param retry_after: How long the cached copy is used without asking after a revalidation failed
+        :param keep_for: How long the last good copy is kept, and served if the site is down, after it stops being fresh
+        :param store: (Optional) Backing store with async load(key) and save(key, value, expires_at) methods, e.g. a
+            Snapshot, so the cached copies survive a restart. Expired entries are left for the ResponseCache sharing the
+            store to drop, which knows how long its own entries are still served after expiring
+        """
+        self.client: BungieClient = client
+        self.default_max_age: int = default_max_age
+        self.revalidate_timeout: float = revalidate_timeout
+        self.retry_after: timedelta = retry_after
+        self.keep_for: timedelta = keep_for
+        self.store = store
+        self._documents: dict = {}  # {url: {'json', 'etag', 'last_modified', 'fresh_until'}}
+        self._in_flight: dict = {}
+        self._retry_at: dict = {}  # {url: datetime} for documents whose last revalidation failed
+
+    def clear(self):
+        self._documents.clear()
+        self._retry_at.clear()
+
+    async def get_json(self, url: str, source: str = 'external') -> dict:
+        """Returns the document at url, from the cache while it is fresh
+
+        :param url: The url of the document
+        :param source: (Optional) Name the request is counted and timed under
+        :return: dict
+        """
+        document: dict = self._documents.get(url)
+        if self.store is not None and (document is None or utc_now() >= document['fresh_until']):
+            document = await self._restore(url)  # another process sharing the store may have revalidated it
+        if document is not None and utc_now() < document['fresh_until']:
+            metrics.counter('http_cache_requests_total', 'External documents by how they were served', source=source,
+                            result='fresh').inc()
+            return document['json']
+        if document is not None and utc_now() < self._retry_at.get(url, document['fresh_until']):
+            metrics.counter('http_cache_requests_total', 'External documents by how they were served', source=source,
+                            result='stale').inc()
+            return document['json']
+        if url not in self._in_flight:  # everyone asking while a revalidation runs waits on that one
+            self._in_flight[url] = asyncio.ensure_future(self._revalidate(url, document, source))
+            self._in_flight[url].add_done_callback(lambda done: self._in_flight.pop(url, None))
+        return await asyncio.shield(self._in_flight[url])
+
+    async def _revalidate(self, url: str, document: dict, source: str) -> dict:
+        headers: dict = {}
+        if document is not None:
+            if document['etag']:
+                headers['If-None-Match'] = document['etag']
+            if document['last_modified']:
+                headers['If-Modified-Since'] = document['last_modified']
+        try:
+            status, response_headers, json = await self.client.fetch(
+                url, headers=headers, source=source,
+                timeout=self.revalidate_timeout if document is not None else None)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if document is None:
+                raise
+            status, response_headers, json = None, {}, None
+
+        if status == 304:
+            result: str = 'not_modified'
+            document = dict(document, fresh_until=self._fresh_until(response_headers))
+        elif status is not None and 200 <= status < 300 and json is not None:
+            result: str = 'modified'
+            document = {'json': json, 'etag': response_headers.get('ETag'),
+                        'last_modified': response_headers.get('Last-Modified'),
+                        'fresh_until': self._fresh_until(response_headers)}
+        elif document is not None:  # the site is down or answered nonsense, the last good copy will do
+            self._retry_at[url] = utc_now() + self.retry_after
+            metrics.counter('http_cache_requests_total', 'External documents by how they were served', source=source,
+                            result='stale').inc()
+            return document['json']
+        else:
+            raise aiohttp.ClientError(f'{url} answered with HTTP {status}')
+
+        metrics.counter('http_cache_requests_total', 'External documents by how they were served', source=source,
+                        result=result).inc()
+        self._documents[url] = document
+        self._retry_at.pop(url, None)
+        if self.store is not None:
+            self.store.save(f'http.{url}', dict(document, fresh_until=document['fresh_until'].isoformat()),
+                            document['fresh_until'] + self.keep_for)
+        return document['json']
+
+    def _fresh_until(self, headers) -> datetime:
+        """Works out how long a response may be reused from its Cache-Control, Age and Expires headers
+
+        :return: datetime
+        """
+        now: datetime = utc_now()
+        cache_control: str = headers.get('Cache-Control', '')
+        if 'no-cache' in cache_control or 'no-store' in cache_control:
+            return now
+        max_age = MAX_AGE.search(cache_control)
+        if max_age:
+            age: int = int(headers.get('Age', '0')) if headers.get('Age', '0').isdigit() else 0
+            return now + timedelta(seconds=max(0, int(max_age.group(1)) - age))
+        if headers.get('Expires'):
+            try:
+                expires: datetime = parsedate_to_datetime(headers['Expires'])
+            except (TypeError, ValueError):
+                return now
+            return max(now, expires if expires.tzinfo else expires.replace(tzinfo=timezone.utc))
+        return now + timedelta(seconds=self.default_max_age)
+
+    async def _restore(self, url: str):
+        try:
+            saved = await self.store.load(f'http.{url}')
+        except Exception as e:  # a broken store only costs us the warm start
+            error_log.record('cache_restore', exc_info=e, Key=url, Store=self.store)
+            return self._documents.get(url)
+        document: dict = self._documents.get(url)
+        fresh_until: datetime = datetime.fromisoformat(saved[0]['fresh_until']) if saved is not None else None
+        if saved is None or (document is not None and document['fresh_until'] >= fresh_until):
+            return document
+        document = dict(saved[0], fresh_until=fresh_until)
+        self._documents[url] = document
+        return document
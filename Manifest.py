@@ -0,0 +1,197 @@
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import zipfile
+from collections import OrderedDict
+
+from pybungie import Definitions
+
+from BungieClient import BungieClient
+from ErrorLog import error_log
+from Metrics import metrics
+from RequestScheduler import background
+
+CONTENT_ROOT_PATH: str = 'https://www.bungie.net'
+MANIFEST_DIRECTORY: str = 'manifest'
+
+
+class Manifest:
+    def __init__(self, client: BungieClient, directory: str = MANIFEST_DIRECTORY, language: str = 'en',
+                 cache_size: int = 4096, check_interval: int = 3600, content_root: str = CONTENT_ROOT_PATH):
+        """Local mirror of the Destiny 2 manifest content database
+
+        Definitions are read from the downloaded content database, which is indexed on the (signed) hash of each
+        entity, with a LRU cache in front of it. The API is only used for definitions the mirror can't provide yet.
+
+        :param client: The client used to check the manifest version and download the content database
+        :param directory: The directory the content database is kept in
+        :param language: The language of the content database
+        :param cache_size: The number of definitions kept in memory
+        :param check_interval: Seconds between checks for a new manifest version
+        :param content_root: Root path the content database is downloaded from
+        """
+        self.client: BungieClient = client
+        self.directory: str = directory
+        self.language: str = language
+        self.cache_size: int = cache_size
+        self.check_interval: int = check_interval
+        self.content_root: str = content_root
+        self.db_path: str = os.path.join(directory, 'world_content.sqlite')
+        self.version_path: str = os.path.join(directory, 'version.txt')
+        self.version = None
+        self._db = None
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = None
+        self._task = None
+        self._open()
+
+    def _open(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        if os.path.exists(self.db_path) and os.path.exists(self.version_path):
+            with open(self.version_path) as f:
+                self.version = f.read().strip()
+            self._db = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True, check_same_thread=False)
+        self._cache.clear()
+
+    async def sync(self) -> bool:
+        """Downloads the content database if Bungie has published a new manifest version
+
+        :return: bool - True if a new version was installed
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            manifest: dict = await self.client.get_manifest()
+            if manifest['version'] == self.version and self._db is not None:
+                return False
+            if manifest['version'] == self._installed_version():  # another bot process sharing the directory did it
+                self._open()
+                return True
+            os.makedirs(self.directory, exist_ok=True)
+            archive_path: str = self._download_path() + '.zip'
+            try:
+                await self.client.download(self.content_root + manifest['mobileWorldContentPaths'][self.language],
+                                           archive_path)
+                await asyncio.get_event_loop().run_in_executor(None, self._extract, archive_path)
+            finally:
+                if os.path.exists(archive_path):
+                    os.remove(archive_path)
+
+            # swap the new database in on the event loop so no lookup ever sees a half installed version
+            os.replace(self._download_path(), self.db_path)
+            with open(self.version_path, 'w') as f:
+                f.write(manifest['version'])
+            self._open()
+            return True
+
+    def _installed_version(self):
+        try:
+            with open(self.version_path) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _download_path(self) -> str:
+        return f'{self.db_path}.{os.getpid()}.tmp'  # processes sharing the directory don't write over each other
+
+    def _extract(self, archive_path: str):
+        with zipfile.ZipFile(archive_path) as archive:
+            with archive.open(archive.namelist()[0]) as content, open(self._download_path(), 'wb') as f:
+                shutil.copyfileobj(content, f)
+
+    async def keep_synced(self):
+        while True:
+            try:
+                await self.sync()
+            except Exception as e:  # the mirror keeps serving the previous version until the next check
+                error_log.record('manifest_sync', exc_info=e)
+            await asyncio.sleep(self.check_interval)
+
+    async def follow(self, interval: float = 30):
+        """Reopens the content database whenever another bot process sharing the directory installs a new version,
+        without asking Bungie.NET itself
+
+        :param interval: Seconds between checks of the installed version
+        """
+        while True:
+            if self._installed_version() not in (None, self.version):
+                self._open()
+            await asyncio.sleep(interval)
+
+    async def installed(self, interval: float = 1):
+        """Waits until there is a content database to read definitions from
+
+        :param interval: Seconds between checks
+        """
+        while self._db is None:
+            await asyncio.sleep(interval)
+
+    def start(self, follow: bool = False):
+        """Starts checking for new manifest versions in the background, does nothing if it is already running
+
+        :param follow: Only pick up the versions another process installs, see follow()
+        """
+        if self._task is None or self._task.done():
+            with background():
+                self._task = asyncio.ensure_future(self.follow() if follow else self.keep_synced())
+
+    def _lookup(self, definition: Definitions, hash_identifier: int):
+        key: tuple = (definition, hash_identifier)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        if self._db is None:
+            return None
+
+        # a primary key read of the local, read-only database takes microseconds, less than handing it to a thread
+        # would, so it runs right here on the event loop
+        # the content database stores each hash as a signed 32 bit integer
+        row_id: int = hash_identifier - (1 << 32) if hash_identifier >= (1 << 31) else hash_identifier
+        row = self._db.execute(f'SELECT json FROM {definition.value} WHERE id=?', (row_id,)).fetchone()
+        if row is None:
+            return None
+        return self._remember(key, json.loads(row[0]))
+
+    def _remember(self, key: tuple, value: dict) -> dict:
+        self._cache[key] = value
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return value
+
+    async def get(self, definition: Definitions, hash_identifier: int) -> dict:
+        """Returns the definition of a single entity
+
+        :param definition: See pybungie.Definitions
+        :param hash_identifier: The hash identifier of the entity
+        :return: dict
+        """
+        return (await self.get_many(definition, [hash_identifier]))[hash_identifier]
+
+    async def get_many(self, definition: Definitions, hash_identifiers: list) -> dict:
+        """Returns the definitions of several entities, any the mirror doesn't have are requested concurrently
+
+        :param definition: See pybungie.Definitions
+        :param hash_identifiers: The hash identifiers of the entities
+        :return: dict - {hash_identifier: definition}
+        """
+        definitions: dict = {}
+        missing: list = []
+        for hash_identifier in hash_identifiers:
+            entity = self._lookup(definition, hash_identifier)
+            if entity is None:
+                missing.append(hash_identifier)
+            else:
+                definitions[hash_identifier] = entity
+
+        metrics.counter('manifest_lookups_total', 'Definition lookups by where they were found', result='local').inc(
+            len(definitions))
+        if missing:
+            metrics.counter('manifest_lookups_total', 'Definition lookups by where they were found', result='api').inc(
+                len(missing))
+            for hash_identifier, entity in (await self.client.manifests(definition.value, missing)).items():
+                definitions[hash_identifier] = self._remember((definition, hash_identifier), entity)
+        return definitions
@@ -0,0 +1,143 @@
+from collections import deque
+from enum import Flag
+
+from better_profanity.constants import ALLOWED_CHARACTERS
+from better_profanity.utils import get_complete_path_of_file, read_wordlist
+
+from xur_quotes import who_is_xur_triggers, salty_triggers, who_are_the_nine_triggers, mentions_xur_triggers
+
+# the substitutions better_profanity.Profanity accepts for each letter of a censored word
+CHARS_MAPPING: dict = {
+    "a": ("a", "@", "*", "4"),
+    "i": ("i", "*", "l", "1"),
+    "o": ("o", "*", "0", "@"),
+    "u": ("u", "*", "v"),
+    "v": ("v", "*", "u"),
+    "l": ("l", "1"),
+    "e": ("e", "*", "3"),
+    "s": ("s", "$", "5"),
+    "t": ("t", "7"),
+}
+
+
+class Category(Flag):
+    """Everything a message can be about, a message can belong to several categories at once
+    """
+    NONE = 0
+    WHO_IS_XUR = 1
+    WHO_ARE_THE_NINE = 2
+    SALTY = 4
+    MENTIONS_XUR = 8
+    PROFANITY = 16
+    HATE_SPEECH = 32
+
+
+class MessageClassifier:
+    def __init__(self, hate_speech_file: str = 'hate_speech.txt', profanity_file: str = None):
+        """Finds every category of a message in a single pass over its lower case text
+
+        Trigger phrases are matched anywhere in the message by an Aho-Corasick automaton. Censored words are
+        matched the way better_profanity matches them, as whole words with character substitutions, by walking one
+        trie built from both word lists. Like better_profanity, a word may run on into as many following words as
+        its list has separators in a single entry, so 'a s s' matches. Unlike it, this holds at the very end of a
+        message too, where better_profanity misses a run ending in a single letter.
+
+        :param hate_speech_file: Word list of hate speech
+        :param profanity_file: (Optional) Word list of general profanity, defaults to better_profanity's list
+        """
+        # Aho-Corasick automaton over the trigger phrases
+        self._goto: list = [{}]
+        self._fail: list = []
+        self._output: list = [0]  # flags are kept as plain ints, which are far cheaper to combine than Category
+        for category, phrases in ((Category.WHO_IS_XUR, who_is_xur_triggers), (Category.SALTY, salty_triggers),
+                                  (Category.WHO_ARE_THE_NINE, who_are_the_nine_triggers),
+                                  (Category.MENTIONS_XUR, mentions_xur_triggers)):
+            for phrase in phrases:
+                self._output[self._add(self._goto, self._output, phrase)] |= category.value
+        self._link()
+
+        # trie over the censored words, with the letters each character of a message can stand in for
+        self._children: list = [{}]
+        self._terminal: list = [0]
+        most_joins: dict = {}  # {category: how many following words better_profanity would join onto a word}
+        profanity_file = profanity_file or get_complete_path_of_file('profanity_wordlist.txt')
+        for category, filename in ((Category.PROFANITY, profanity_file), (Category.HATE_SPEECH, hate_speech_file)):
+            most_joins[category.value] = 1
+            for word in read_wordlist(filename):
+                self._terminal[self._add(self._children, self._terminal, word.lower())] |= category.value
+                most_joins[category.value] = max(most_joins[category.value],
+                                                 sum(char not in ALLOWED_CHARACTERS for char in word))
+        self._most_joins: int = max(most_joins.values())
+        # the categories that can still match after a number of joins, e.g. a hate speech list of single words
+        # never matches three words run together
+        self._joinable: list = [sum(value for value, joins in most_joins.items() if joins >= number)
+                                for number in range(self._most_joins + 1)]
+        self._stands_for: dict = {}
+        for letter, substitutes in CHARS_MAPPING.items():
+            for substitute in substitutes:
+                self._stands_for.setdefault(substitute, {substitute}).add(letter)
+
+    @staticmethod
+    def _add(children: list, flags: list, word: str) -> int:
+        node: int = 0
+        for char in word:
+            if char not in children[node]:
+                children[node][char] = len(children)
+                children.append({})
+                flags.append(0)
+            node = children[node][char]
+        return node
+
+    def _link(self):
+        self._fail = [0] * len(self._goto)
+        queue: deque = deque(self._goto[0].values())
+        while queue:
+            node: int = queue.popleft()
+            for char, child in self._goto[node].items():
+                fail: int = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._output[child] |= self._output[self._fail[child]]
+                queue.append(child)
+
+    def classify(self, content: str) -> Category:
+        """Returns every category the message belongs to
+
+        :param content: The message's text
+        :return: Category
+        """
+        goto, fail, output = self._goto, self._fail, self._output
+        children, terminal, stands_for = self._children, self._terminal, self._stands_for
+        most_joins, joinable = self._most_joins, self._joinable
+        found: int = 0
+        state: int = 0
+        words: set = set()  # (censored word trie node, words joined to reach it) reached so far
+        parked: set = set()  # nodes at the end of a word, which may carry on into the next word without a separator
+        in_word: bool = False
+
+        for char in content.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            found |= output[state]
+
+            if char in ALLOWED_CHARACTERS:
+                if not in_word:
+                    words = {(node, joins + 1) for node, joins in words | parked if joins < most_joins}
+                    words.add((0, 0))
+                    parked = set()
+                    in_word = True
+            elif in_word:
+                for node, joins in words:
+                    found |= terminal[node] & joinable[joins]
+                parked = words
+                in_word = False
+            if words:
+                words = {(child, joins) for node, joins in words for letter in stands_for.get(char, char)
+                         for child in (children[node].get(letter),) if child is not None}
+
+        if in_word:
+            for node, joins in words:
+                found |= terminal[node] & joinable[joins]
+        return Category(found)
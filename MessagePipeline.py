@@ -0,0 +1,133 @@
+import asyncio
+import itertools
+from collections import deque
+from time import perf_counter
+
+import discord
+
+from ErrorLog import error_log
+from Metrics import metrics
+
+MODERATION: int = 0  # priorities in the pipeline's queue, lower goes first
+CHANNEL: int = 1
+
+
+class Action:
+    __slots__ = ('run', 'key', 'queued_at')
+
+    def __init__(self, run, key: str = None):
+        """Something the bot does in response to a message
+
+        :param run: Function returning the awaitable that does it
+        :param key: (Optional) Actions with the same key waiting in the same channel are sent only once
+        """
+        self.run = run
+        self.key: str = key
+        self.queued_at: float = perf_counter()
+
+
+class MessagePipeline:
+    def __init__(self, workers: int = 4, channel_limit: int = 20):
+        """Carries out the bot's responses to messages off the on_message path
+
+        Moderation goes first, whatever channel it is in. Everything else waits in a queue per channel, so a
+        channel's replies are sent in order, and channels take turns so a busy one can't hold up the rest. A reply
+        that is already waiting to be sent in a channel isn't queued again, which keeps spam from turning into as
+        many replies. At most workers actions run at once, whatever the load.
+
+        :param workers: How many actions may be in progress at once
+        :param channel_limit: How many actions a channel may have waiting, the oldest is dropped to make room
+        """
+        self.workers: int = workers
+        self.channel_limit: int = channel_limit
+        self._queue = None  # (priority, order, Action or channel id)
+        self._channels: dict = {}  # {channel id: deque of Action}, only for channels with work waiting
+        self._order = itertools.count()
+        self._tasks: list = []
+        self._depth = metrics.gauge('pipeline_waiting_actions', 'Actions waiting in the message pipeline')
+        self._coalesced = metrics.counter('pipeline_coalesced_total', 'Replies skipped as already waiting')
+        self._dropped = metrics.counter('pipeline_dropped_total', 'Actions dropped from a full channel queue')
+
+    def moderate(self, message: discord.Message):
+        """Deletes a message ahead of everything else waiting
+        """
+        self._put(MODERATION, Action(message.delete))
+
+    def reply(self, channel: discord.abc.Messageable, content: str, key: str = None):
+        """Sends content to channel after everything already waiting for it
+
+        :param channel: Where to send it
+        :param content: What to send
+        :param key: (Optional) If a reply with the same key is still waiting in channel, this one is dropped
+        """
+        self._enqueue(channel, Action(lambda: channel.send(content), key))
+
+    def react(self, message: discord.Message, emoji: str):
+        """Adds a reaction to a message after everything already waiting for its channel
+        """
+        self._enqueue(message.channel, Action(lambda: message.add_reaction(emoji=emoji)))
+
+    def _enqueue(self, channel, action: Action):
+        waiting: deque = self._channels.get(channel.id)
+        if waiting is None:
+            waiting = self._channels[channel.id] = deque()
+            self._put(CHANNEL, channel.id)  # a channel is in the queue at most once, which keeps its actions in order
+        elif action.key is not None and any(queued.key == action.key for queued in waiting):
+            self._coalesced.inc()
+            return
+        elif len(waiting) >= self.channel_limit:
+            waiting.popleft()
+            self._dropped.inc()
+            self._depth.dec()
+        waiting.append(action)
+        self._depth.inc()
+
+    def _put(self, priority: int, item):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        if not self._tasks:
+            self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+        if priority == MODERATION:
+            self._depth.inc()
+        self._queue.put_nowait((priority, next(self._order), item))
+
+    async def _work(self):
+        while True:
+            priority, _, item = await self._queue.get()
+            try:
+                if priority == MODERATION:
+                    await self._run(item, 'moderation')
+                else:
+                    waiting: deque = self._channels[item]
+                    await self._run(waiting.popleft(), 'reply')
+                    if waiting:  # back of the line, so other channels get a turn
+                        self._queue.put_nowait((CHANNEL, next(self._order), item))
+                    else:
+                        del self._channels[item]
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, action: Action, kind: str):
+        self._depth.dec()
+        try:
+            await action.run()
+        except discord.NotFound:  # the message was deleted by someone else first
+            pass
+        except Exception as e:
+            metrics.counter('pipeline_failures_total', 'Actions that failed', kind=kind).inc()
+            error_log.record(f'pipeline_{kind}', exc_info=e)
+        metrics.histogram('pipeline_latency_seconds', 'Time from queueing an action to completing it',
+                          kind=kind).observe(perf_counter() - action.queued_at)
+
+    async def drain(self):
+        """Waits until every action queued so far has been carried out
+        """
+        if self._queue is not None:
+            await self._queue.join()
+
+    def close(self):
+        """Stops the workers, anything still waiting is dropped
+        """
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
@@ -0,0 +1,237 @@
+import asyncio
+import functools
+import os
+from bisect import bisect_left
+from time import perf_counter
+
+from aiohttp import web
+
+# upper bounds in seconds, fine enough to tell a cached answer from a round-trip to Bungie.NET
+DEFAULT_BUCKETS: tuple = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Counter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value: float = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Gauge:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value: float = 0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count', 'max')
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets: tuple = buckets
+        self.counts: list = [0] * (len(buckets) + 1)  # the last slot counts observations above every bucket
+        self.sum: float = 0
+        self.count: int = 0
+        self.max: float = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile as the upper bound of the bucket it falls in
+
+        :param q: Between 0 and 1
+        :return: float
+        """
+        if not self.count:
+            return 0
+        rank: float = q * self.count
+        seen: int = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def time(self):
+        return Timer(self)
+
+
+class Timer:
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram: Histogram):
+        """Context manager that observes the seconds spent inside it, usable inside coroutines as well
+        """
+        self.histogram: Histogram = histogram
+
+    def __enter__(self):
+        self.started: float = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(perf_counter() - self.started)
+
+
+class Metrics:
+    def __init__(self, prefix: str = 'xur_bot'):
+        """Registry of every counter, gauge and histogram the bot keeps
+
+        Each metric is a name plus labels, its object is created on first use and can be kept by the caller, so
+        recording a value is an attribute update rather than a lookup.
+
+        :param prefix: Prepended to every metric name when exported
+        """
+        self.prefix: str = prefix
+        self._metrics: dict = {}  # {name: (type, help, {labels: metric})}
+        self._lag_task = None
+        self._server = None
+
+    def _get(self, kind, name: str, help_text: str, labels: dict):
+        family = self._metrics.get(name)
+        if family is None:
+            family = self._metrics[name] = (kind, help_text, {})
+        key: tuple = tuple(sorted(labels.items()))
+        metric = family[2].get(key)
+        if metric is None:
+            metric = family[2][key] = kind()
+        return metric
+
+    def counter(self, name: str, help_text: str = '', **labels) -> Counter:
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name: str, help_text: str = '', **labels) -> Gauge:
+        return self._get(Gauge, name, help_text, labels)
+
+    def histogram(self, name: str, help_text: str = '', **labels) -> Histogram:
+        return self._get(Histogram, name, help_text, labels)
+
+    def timed(self, name: str, help_text: str = '', **labels):
+        """Decorator timing every call of a coroutine function into a histogram
+
+        :return: function
+        """
+        histogram: Histogram = self.histogram(name, help_text, **labels)
+
+        def decorator(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with histogram.time():
+                    return await function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def family(self, name: str) -> dict:
+        """Returns every metric recorded under name
+
+        :return: dict - {labels: metric}, labels being a tuple of (label, value) pairs
+        """
+        return self._metrics.get(name, (None, None, {}))[2]
+
+    def render(self) -> str:
+        """Exports every metric in the Prometheus text format
+
+        :return: str
+        """
+        lines: list = []
+        for name, (kind, help_text, metrics) in sorted(self._metrics.items()):
+            full_name: str = f'{self.prefix}_{name}'
+            if help_text:
+                lines.append(f'# HELP {full_name} {_escape(help_text, quotes=False)}')
+            lines.append(f'# TYPE {full_name} {kind.__name__.lower()}')
+            for labels, metric in sorted(metrics.items()):
+                if kind is Histogram:
+                    cumulative: int = 0
+                    for bound, count in zip(metric.buckets + ('+Inf',), metric.counts):
+                        cumulative += count
+                        lines.append(f'{full_name}_bucket{_labels(labels + (("le", bound),))} {cumulative}')
+                    lines.append(f'{full_name}_sum{_labels(labels)} {metric.sum}')
+                    lines.append(f'{full_name}_count{_labels(labels)} {metric.count}')
+                else:
+                    lines.append(f'{full_name}{_labels(labels)} {metric.value}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> list:
+        """One line per metric, histograms as their count and estimated percentiles in milliseconds
+
+        :return: list of str
+        """
+        lines: list = []
+        for name, (kind, _, metrics) in sorted(self._metrics.items()):
+            for labels, metric in sorted(metrics.items()):
+                title: str = name + _labels(labels)
+                if kind is Histogram:
+                    lines.append(f'{title} n={metric.count} p50={metric.quantile(0.5) * 1000:.1f}ms '
+                                 f'p99={metric.quantile(0.99) * 1000:.1f}ms max={metric.max * 1000:.1f}ms')
+                else:
+                    lines.append(f'{title} {metric.value:g}')
+        return lines
+
+    async def watch_loop_lag(self, interval: float = 0.5):
+        """Measures how late the event loop wakes a sleeping task, which is how long something blocked it
+        """
+        histogram: Histogram = self.histogram('event_loop_lag_seconds', 'Delay in waking a sleeping task')
+        gauge: Gauge = self.gauge('event_loop_lag_last_seconds', 'The most recent event loop lag')
+        loop = asyncio.get_event_loop()
+        while True:
+            started: float = loop.time()
+            await asyncio.sleep(interval)
+            lag: float = max(0, loop.time() - started - interval)
+            histogram.observe(lag)
+            gauge.set(lag)
+
+    async def serve(self, port: int, host: str = '127.0.0.1'):
+        """Serves render() at http://host:port/metrics for Prometheus to scrape
+
+        :param port: Port to listen on
+        :param host: Interface to listen on, only the local machine by default
+        """
+        async def handle(request: web.Request) -> web.Response:
+            return web.Response(text=self.render(), content_type='text/plain', charset='utf-8')
+
+        app: web.Application = web.Application()
+        app.router.add_get('/metrics', handle)
+        runner: web.AppRunner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+
+    def start(self):
+        """Starts measuring event loop lag and, if METRICS_PORT is set, serving the metrics endpoint. Does nothing
+        if it is already running
+        """
+        if self._lag_task is None or self._lag_task.done():
+            self._lag_task = asyncio.ensure_future(self.watch_loop_lag())
+        port: str = os.getenv('METRICS_PORT')
+        if port and self._server is None:
+            self._server = asyncio.ensure_future(self.serve(int(port), os.getenv('METRICS_HOST', '127.0.0.1')))
+
+
+def _escape(text, quotes: bool = True) -> str:
+    """Escapes a label value, or a HELP text without quotes, the way the Prometheus text format requires"""
+    text = str(text).replace('\\', '\\\\').replace('\n', '\\n')
+    return text.replace('"', '\\"') if quotes else text
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{label}="{_escape(value)}"' for label, value in labels) + '}'
+
+
+metrics = Metrics()
@@ -0,0 +1,152 @@
+import asyncio
+import heapq
+import itertools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+
+from Metrics import metrics
+
+
+class Priority(IntEnum):
+    """Lower values are let through first"""
+    USER = 0
+    BACKGROUND = 1
+
+
+# the priority of requests made by the current task, tasks started from it inherit it
+priority: ContextVar = ContextVar('priority', default=Priority.USER)
+
+
+@contextmanager
+def background():
+    """Marks every request made inside the block, and by tasks started inside it, as background work
+    """
+    token = priority.set(Priority.BACKGROUND)
+    try:
+        yield
+    finally:
+        priority.reset(token)
+
+
+class RequestRejected(Exception):
+    def __init__(self, reason: str):
+        """Raised when a request can't be given a turn, either because too many are already waiting or because it
+        waited too long
+
+        :param reason: 'queue_full' or 'timeout'
+        """
+        super().__init__(f'request rejected: {reason}')
+        self.reason: str = reason
+
+
+class RequestScheduler:
+    def __init__(self, rate: float = 20, burst: int = 20, max_queue: int = 200, queue_timeout: float = 15):
+        """Token bucket deciding when each outgoing request may be sent
+
+        Waiting requests are let through in priority order, then in the order they arrived. While the upstream API
+        asks us to back off, no request is let through at all.
+
+        :param rate: Requests allowed per second on average
+        :param burst: Requests that may be sent at once after a quiet period
+        :param max_queue: Requests that may wait for a turn before new ones are rejected
+        :param queue_timeout: Seconds a request may wait for a turn before it is rejected
+        """
+        self.rate: float = rate
+        self.burst: int = burst
+        self.max_queue: int = max_queue
+        self.queue_timeout: float = queue_timeout
+        self._tokens: float = burst
+        self._updated: float = None
+        self._paused_until: float = 0
+        self._waiting: list = []  # heap of (priority, arrival, future)
+        self._arrivals = itertools.count()
+        self._wake_up = None
+
+    def _refill(self, now: float):
+        if self._updated is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def turn(self, request_priority: Priority = None):
+        """Waits until a request may be sent
+
+        :param request_priority: (Optional) Defaults to the priority of the current context
+        :raise RequestRejected: If the queue is full, the turn doesn't come within queue_timeout or a request of a
+            higher priority needs the place in the queue
+        """
+        request_priority = priority.get() if request_priority is None else request_priority
+        if len(self._waiting) >= self.max_queue and not self._make_room(request_priority):
+            metrics.counter('scheduler_rejected_total', 'Requests refused a turn', reason='queue_full').inc()
+            raise RequestRejected('queue_full')
+
+        loop = asyncio.get_event_loop()
+        future: asyncio.Future = loop.create_future()
+        heapq.heappush(self._waiting, (request_priority, next(self._arrivals), future))
+        self._dispatch()
+        try:
+            with metrics.histogram('scheduler_wait_seconds', 'Time requests waited for a turn',
+                                   priority=request_priority.name.lower()).time():
+                await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()  # _dispatch skips cancelled entries
+                metrics.counter('scheduler_rejected_total', 'Requests refused a turn', reason='timeout').inc()
+                raise RequestRejected('timeout')
+            future.result()  # given its turn or evicted just as the wait ran out, the latter raises RequestRejected
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                future.exception()  # an eviction nobody is left to hear about shouldn't be reported as unretrieved
+            future.cancel()
+            raise
+
+    def _make_room(self, request_priority: Priority) -> bool:
+        """Drops the requests that gave up waiting, and if that isn't enough, the last waiting request of a lower
+        priority, so background work can never keep a user's request out of the queue
+
+        :return: bool - Whether there is room now
+        """
+        self._waiting = [entry for entry in self._waiting if not entry[2].done()]
+        heapq.heapify(self._waiting)
+        if len(self._waiting) < self.max_queue:
+            return True
+        last: tuple = max(self._waiting)
+        if last[0] <= request_priority:
+            return False
+        self._waiting.remove(last)
+        heapq.heapify(self._waiting)
+        last[2].set_exception(RequestRejected('queue_full'))
+        metrics.counter('scheduler_rejected_total', 'Requests refused a turn', reason='evicted').inc()
+        return True
+
+    def backoff(self, seconds: float):
+        """Stops letting requests through for the given number of seconds
+
+        :param seconds: How long the upstream API asked us to wait
+        """
+        loop = asyncio.get_event_loop()
+        self._paused_until = max(self._paused_until, loop.time() + seconds)
+        metrics.counter('scheduler_backoffs_total', 'Times the upstream API asked us to slow down').inc()
+
+    def _dispatch(self):
+        """Lets through as many waiting requests as there are tokens, and schedules itself for when the next token
+        is due
+        """
+        loop = asyncio.get_event_loop()
+        if self._wake_up is not None:
+            self._wake_up.cancel()
+            self._wake_up = None
+        now: float = loop.time()
+        self._refill(now)
+        while self._waiting:
+            if self._waiting[0][2].done():  # cancelled while waiting
+                heapq.heappop(self._waiting)
+                continue
+            if now < self._paused_until:
+                self._wake_up = loop.call_at(self._paused_until, self._dispatch)
+                return
+            if self._tokens < 1:
+                self._wake_up = loop.call_at(now + (1 - self._tokens) / self.rate, self._dispatch)
+                return
+            self._tokens -= 1
+            heapq.heappop(self._waiting)[2].set_result(None)
@@ -0,0 +1,94 @@
+import asyncio
+import random
+from datetime import datetime
+
+from ErrorLog import error_log
+from Metrics import metrics
+from RequestScheduler import background
+from Vendor import RegularVendor, Xur, refresh_vendor_sales
+from VendorDictionary import VendorDictionary
+from reset_calendar import next_daily_reset, next_weekly_reset, next_xur_arrival, utc_now
+from pybungie import VendorHash
+
+
+class ResetScheduler:
+    def __init__(self, xur: Xur, vendors: VendorDictionary, concurrency: int = 4, jitter: float = 20,
+                 settle: float = 30):
+        """Refreshes vendor inventories in the background whenever they change, so commands never wait on the API
+
+        After each daily reset (and weekly reset, which falls on a daily one) every vendor's bounties are fetched
+        again, and after Xur arrives so are his inventory and location. Each refresh replaces the cached copy only
+        once it is complete, so commands keep reading the previous one until then.
+
+        :param xur: The Xur the !xur command answers with
+        :param vendors: The vendors the !bounties command answers with
+        :param concurrency: How many vendors are refreshed at once
+        :param jitter: Up to how many seconds each refresh is delayed by, so they don't all start at once
+        :param settle: Seconds waited after a reset before refreshing, giving Bungie.NET time to roll over
+        """
+        self.xur: Xur = xur
+        self.vendors: VendorDictionary = vendors
+        self.concurrency: int = concurrency
+        self.jitter: float = jitter
+        self.settle: float = settle
+        self._task = None
+
+    @staticmethod
+    def next_events(now: datetime = None) -> (datetime, list):
+        """Returns when the next reset is and which resets happen then
+
+        :return: (datetime, list) - e.g. (next Friday at 17:00 UTC, ['daily', 'xur'])
+        """
+        events: list = [(next_daily_reset(now), 'daily'), (next_weekly_reset(now), 'weekly'),
+                        (next_xur_arrival(now), 'xur')]
+        when: datetime = min(moment for moment, _ in events)
+        return when, [name for moment, name in events if moment == when]
+
+    def regular_vendors(self) -> list:
+        vendors = (self.vendors.vendor(vendor_hash) for vendor_hash in VendorHash)
+        return [vendor for vendor in vendors if vendor is not None and not isinstance(vendor, Xur)]
+
+    async def refresh(self, events: list, prime: bool = False):
+        """Refreshes every vendor affected by events, at most concurrency at a time
+
+        :param events: Names of the resets that happened, see next_events
+        :param prime: Only fill in what's missing from the cache instead of fetching everything again
+        """
+        semaphore: asyncio.Semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def refresh_vendor(vendor: RegularVendor):
+            await asyncio.sleep(random.uniform(0, self.jitter))
+            async with semaphore:
+                try:
+                    await (vendor.inventory() if prime else vendor.refresh())
+                except Exception as e:  # the vendor is fetched on demand instead, and retried at the next reset
+                    metrics.counter('scheduled_refresh_failures_total', 'Vendors that failed to refresh').inc()
+                    error_log.record('scheduled_refresh', exc_info=e, Vendor=vendor.hash_id.name)
+
+        jobs: list = []
+        if 'daily' in events or 'weekly' in events:
+            if not prime:
+                try:
+                    await refresh_vendor_sales()  # every vendor is then built from the same new snapshot
+                except Exception as e:
+                    error_log.record('scheduled_refresh', exc_info=e, Vendor='every vendor\'s sales')
+            jobs += [refresh_vendor(vendor) for vendor in self.regular_vendors()]
+        if 'xur' in events and self.xur.calendar.is_present():
+            jobs.append(refresh_vendor(self.xur))
+        with metrics.histogram('scheduled_refresh_seconds', 'Time taken to refresh every vendor after a reset',
+                               event='+'.join(events)).time():
+            await asyncio.gather(*jobs)
+
+    async def run(self):
+        with background():
+            await self.refresh(['daily', 'weekly', 'xur'], prime=True)
+            while True:
+                when, events = self.next_events()
+                await asyncio.sleep(max(0.0, (when - utc_now()).total_seconds()) + self.settle)
+                await self.refresh(events)
+
+    def start(self):
+        """Starts refreshing at every reset, does nothing if it is already running
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self.run())
@@ -0,0 +1,142 @@
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from ErrorLog import error_log
+from Metrics import metrics
+from RequestScheduler import background
+from reset_calendar import utc_now
+
+
+def key_label(key) -> str:
+    """Turns a cache key into the string it is counted and stored under, e.g. (2190858386, 'location') becomes
+    '2190858386.location'
+
+    :return: str
+    """
+    return '.'.join(map(str, key)) if isinstance(key, tuple) else str(key)
+
+
+class CacheEntry:
+    __slots__ = ('value', 'expires_at')
+
+    def __init__(self, value, expires_at: datetime):
+        self.value = value
+        self.expires_at: datetime = expires_at
+
+
+class ResponseCache:
+    def __init__(self, max_size: int = 128, stale_for: timedelta = timedelta(minutes=5), name: str = 'response',
+                 store=None):
+        """Cache shared by every vendor, entries expire at the reset boundary they were fetched for
+
+        Concurrent misses for the same key wait on a single fetch. An entry that expired less than stale_for ago is
+        still returned while a fresh copy is fetched in the background.
+
+        :param max_size: Number of entries kept before the least recently used one is evicted
+        :param stale_for: How long after expiring an entry may still be served while it is being refreshed
+        :param name: Name the cache's hits and misses are counted under
+        :param store: (Optional) Backing store with async load(key), save(key, value, expires_at, now) and
+            coalesce(key, fetch, is_current) methods, e.g. a Snapshot or a SharedStore. Fetched values are saved to it
+            and entries missing from memory or expired are looked up in it
+        """
+        self.name: str = name
+        self.store = store
+        self.max_size: int = max_size
+        self.stale_for: timedelta = stale_for
+        self._entries: OrderedDict = OrderedDict()
+        self._in_flight: dict = {}
+        self._forced: set = set()  # keys whose running fetch is forced
+
+    def put(self, key, value, expires_at: datetime):
+        self._entries[key] = CacheEntry(value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    async def get(self, key, fetch, expires_at: datetime, allow_stale: bool = True):
+        """Returns the cached value for key, fetching it if it is missing or expired
+
+        :param key: Usually the vendor's hash
+        :param fetch: Coroutine function returning a fresh value
+        :param expires_at: The reset boundary a freshly fetched value is valid until
+        :param allow_stale: Whether a recently expired value may be returned while it is refreshed. Values that other
+            entries are built from shouldn't be, or the stale copy would be cached again until the next reset
+        :return: The cached or freshly fetched value
+        """
+        entry: CacheEntry = self._entries.get(key)
+        if self.store is not None and (entry is None or utc_now() >= entry.expires_at):
+            entry = await self._restore(key)  # another process sharing the store may have fetched it already
+        if entry is not None:
+            now: datetime = utc_now()
+            if now < entry.expires_at:
+                self._entries.move_to_end(key)
+                self._count(key, 'hit')
+                return entry.value
+            if allow_stale and now < entry.expires_at + self.stale_for:
+                self._count(key, 'stale')
+                with background():  # nobody waits on it, so it mustn't take a turn from a user's request
+                    self.refresh(key, fetch, expires_at)
+                return entry.value
+        self._count(key, 'miss')
+        return await asyncio.shield(self.refresh(key, fetch, expires_at))
+
+    async def _restore(self, key):
+        try:
+            saved = await self.store.load(key_label(key))
+        except Exception as e:  # a broken store only costs us the warm start
+            error_log.record('cache_restore', exc_info=e, Key=key_label(key), Store=self.store)
+            return self._entries.get(key)
+        entry: CacheEntry = self._entries.get(key)  # may have been fetched while the store was read
+        if saved is None or (entry is not None and entry.expires_at >= saved[1]):
+            return entry
+        metrics.counter('cache_restored_total', 'Entries restored from the backing store', cache=self.name).inc()
+        self.put(key, *saved)
+        return self._entries[key]
+
+    def _count(self, key, result: str):
+        metrics.counter('cache_requests_total', 'Cache lookups by key and result', cache=self.name,
+                        key=key_label(key), result=result).inc()
+
+    def refresh(self, key, fetch, expires_at: datetime, force: bool = False) -> asyncio.Future:
+        """Fetches a fresh value for key, joining the fetch that is already running for it if there is one
+
+        :param force: Fetch even if a value was already fetched for the same reset boundary, e.g. by a user right
+            after the reset, before Bungie.NET had rolled over. A forced fetch starts after the running one instead
+            of joining it
+        :return: asyncio.Future resolving to the fresh value
+        """
+        if key not in self._in_flight or force and key not in self._forced:
+            task: asyncio.Future = asyncio.ensure_future(self._fetch(key, fetch, expires_at, force,
+                                                                     after=self._in_flight.get(key)))
+            task.add_done_callback(lambda done: self._done(key, done))
+            self._in_flight[key] = task
+            if force:
+                self._forced.add(key)
+        return self._in_flight[key]
+
+    async def _fetch(self, key, fetch, expires_at: datetime, force: bool = False, after: asyncio.Future = None):
+        if after is not None:
+            await asyncio.wait([after])
+        if self.store is None:
+            value = await fetch()
+        else:
+            async def fetch_and_save():
+                fetched = await fetch()
+                self.store.save(key_label(key), fetched, expires_at, now=utc_now() - self.stale_for)
+                return fetched
+            # a value saved for the same reset boundary by another process is just as fresh, unless forced
+            value = await self.store.coalesce(key_label(key), fetch_and_save,
+                                              lambda _, saved_expires_at: not force and saved_expires_at >= expires_at)
+        self.put(key, value, expires_at)
+        return value
+
+    def _done(self, key, task: asyncio.Future):
+        if self._in_flight.get(key) is task:  # a forced fetch may have taken its place
+            del self._in_flight[key]
+            self._forced.discard(key)
+        if not task.cancelled():
+            task.exception()  # a failed background refresh nobody is waiting on shouldn't be reported as unretrieved
@@ -0,0 +1,195 @@
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import time
+from datetime import datetime
+
+from Database import SerialDatabase
+from ErrorLog import error_log
+from Metrics import metrics
+
+SHARED_CACHE_PATH: str = 'shared_cache.db'
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS entries_expires_at ON entries (expires_at);
+CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL);
+"""
+
+
+class SharedStore(SerialDatabase):
+    def __init__(self, path: str = SHARED_CACHE_PATH, fetch_lease: float = 30, poll_interval: float = 0.25):
+        """Backing store shared by every bot process on the machine, so a shard answers from what any other shard
+        has already fetched
+
+        Works wherever a Snapshot does, entries are kept in a sqlite database in WAL mode so readers never wait on
+        the writer. Besides the entries it keeps leases: a named lease is held by one process at a time until it
+        stops renewing it, which is how a single process is elected to do the background refreshing and how only
+        one process at a time fetches any given key.
+
+        :param path: Path of the database, every process pointing at the same file shares the cache
+        :param fetch_lease: Seconds a process may take to fetch a key before another one is allowed to try
+        :param poll_interval: Seconds between checks while another process is fetching a key
+        """
+        super().__init__(path, 'shared_cache_query_seconds', 'Time spent running shared cache queries', timeout=10,
+                         isolation_level=None)
+        self.fetch_lease: float = fetch_lease
+        self.poll_interval: float = poll_interval
+        self.holder: str = f'{socket.gethostname()}:{os.getpid()}'
+        self._pending = None
+
+    def __repr__(self) -> str:
+        return f'SharedStore({self.path!r})'
+
+    def prepare(self, db: sqlite3.Connection):
+        db.executescript(SCHEMA)
+
+    async def load(self, key: str):
+        """Returns the saved value of key and when it expires, as last saved by any process
+
+        :param key: The cache key, as a string
+        :return: (value, datetime) or None if nothing is saved under key
+        """
+        row: tuple = await self.run(_load, key)
+        if row is None:
+            return None
+        return json.loads(row[0]), datetime.fromisoformat(row[1])
+
+    def save(self, key: str, value, expires_at: datetime, now: datetime = None):
+        """Saves the value of key in the background. Entries that expired before now are dropped at the same time
+
+        :param key: The cache key, as a string
+        :param value: Anything json can encode
+        :param expires_at: When the value stops being valid
+        :param now: (Optional) The time entries are considered expired at, defaults to never dropping any
+        """
+        data: str = json.dumps(value, separators=(',', ':'))
+        self._pending = asyncio.ensure_future(self.run(_save, key, data, expires_at.isoformat(),
+                                                       now.isoformat() if now is not None else None))
+        self._pending.add_done_callback(self._report_failure)
+
+    def _report_failure(self, task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            error_log.record('shared_cache_write', exc_info=task.exception(), Path=self.path)
+
+    async def flush(self):
+        """Waits until every save so far is in the database
+        """
+        if self._pending is not None:
+            await asyncio.wait([self._pending])
+
+    async def clear(self):
+        """Forgets every entry, for every process
+        """
+        await self.run(_clear)
+
+    async def acquire(self, name: str, ttl: float) -> bool:
+        """Takes or renews the lease name for ttl seconds, unless another process holds it
+
+        :return: bool - Whether this process holds the lease now
+        """
+        try:
+            return await self.run(_acquire, name, self.holder, time.time(), ttl)
+        except sqlite3.Error as e:  # an unreachable database means nobody can be sure they hold it
+            error_log.record('shared_cache_lease', exc_info=e, Path=self.path, Lease=name)
+            return False
+
+    async def release(self, name: str):
+        """Gives up the lease name if this process holds it, so another may take it right away
+        """
+        try:
+            await self.run(_release, name, self.holder)
+        except sqlite3.Error as e:  # the lease runs out on its own
+            error_log.record('shared_cache_lease', exc_info=e, Path=self.path, Lease=name)
+
+    async def coalesce(self, key: str, fetch, is_current):
+        """Fetches the value of key in only one process at a time, the others wait for it to be saved
+
+        :param key: The cache key, as a string
+        :param fetch: Coroutine function fetching the value and saving it under key
+        :param is_current: Function taking a saved (value, expires_at), telling whether it already is what fetch
+            would return, in which case it is used instead of fetching
+        :return: The fetched or saved value
+        """
+        lease: str = f'fetch.{key}'
+        waited: bool = False
+        while True:
+            try:
+                saved = await self.load(key)
+                current: bool = saved is not None and is_current(*saved)
+                acquired: bool = not current and await self.run(_acquire, lease, self.holder, time.time(),
+                                                                self.fetch_lease)
+            except (sqlite3.Error, ValueError) as e:  # a broken store only costs the coordination, not the value
+                error_log.record('shared_cache_read', exc_info=e, Path=self.path, Key=key)
+                metrics.counter('shared_cache_fetches_total', 'Fetches of shared keys by who did them',
+                                result='store_failed').inc()
+                return await fetch()
+            if current:
+                metrics.counter('shared_cache_fetches_total', 'Fetches of shared keys by who did them',
+                                result='other_process' if waited else 'already_saved').inc()
+                return saved[0]
+            if acquired:
+                try:
+                    value = await fetch()
+                    await self.flush()  # the others are let in once it has been saved
+                finally:
+                    await self.release(lease)
+                metrics.counter('shared_cache_fetches_total', 'Fetches of shared keys by who did them',
+                                result='this_process').inc()
+                return value
+            waited = True
+            await asyncio.sleep(self.poll_interval)
+
+    async def lead(self, name: str, work, ttl: float = 60):
+        """Runs work() while this process holds the lease name, for as long as the bot runs. If the process holding
+        it goes away, another one takes over once the lease runs out
+
+        :param name: Name of the lease, every process competing for the same work uses the same name
+        :param work: Coroutine function doing the work, cancelled if the lease is lost
+        :param ttl: Seconds the lease lasts unless renewed, it is renewed three times as often
+        """
+        leading = metrics.gauge('shared_cache_leader', 'Whether this process holds the lease', lease=name)
+        while True:
+            if await self.acquire(name, ttl):
+                leading.set(1)
+                task: asyncio.Future = asyncio.ensure_future(work())
+                try:
+                    while not task.done():
+                        await asyncio.wait([task], timeout=ttl / 3)
+                        if not task.done() and not await self.acquire(name, ttl):  # another process took over
+                            break
+                finally:
+                    task.cancel()
+                    leading.set(0)
+                if task.done() and not task.cancelled() and task.exception() is not None:
+                    error_log.record(name, exc_info=task.exception())
+                    await self.release(name)  # let a healthier process have a go
+            await asyncio.sleep(ttl / 3)
+
+
+def _load(db: sqlite3.Connection, key: str):
+    return db.execute('SELECT value, expires_at FROM entries WHERE key = ?', (key,)).fetchone()
+
+
+def _save(db: sqlite3.Connection, key: str, value: str, expires_at: str, now: str):
+    db.execute('INSERT OR REPLACE INTO entries (key, value, expires_at) VALUES (?, ?, ?)', (key, value, expires_at))
+    if now is not None:
+        db.execute('DELETE FROM entries WHERE expires_at < ?', (now,))
+
+
+def _clear(db: sqlite3.Connection):
+    db.execute('DELETE FROM entries')
+
+
+def _acquire(db: sqlite3.Connection, name: str, holder: str, now: float, ttl: float) -> bool:
+    # one statement, so two processes can't both find the lease free and take it
+    db.execute('INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) '
+               'ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at '
+               'WHERE leases.holder = excluded.holder OR leases.expires_at < ?', (name, holder, now + ttl, now))
+    return db.execute('SELECT holder FROM leases WHERE name = ?', (name,)).fetchone()[0] == holder
+
+
+def _release(db: sqlite3.Connection, name: str, holder: str):
+    db.execute('DELETE FROM leases WHERE name = ? AND holder = ?', (name, holder))
@@ -0,0 +1,131 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+
+from ErrorLog import error_log
+
+SNAPSHOT_PATH: str = 'snapshot.json'
+
+
+class Snapshot:
+    def __init__(self, path: str = SNAPSHOT_PATH):
+        """On-disk copy of the response cache, so a restarted bot answers from the data it had already fetched
+
+        The file is read the first time an entry is asked for, and rewritten as a whole after every save. Each
+        write goes to a temporary file that then replaces the snapshot, so a crash mid-write leaves the previous
+        snapshot intact.
+
+        :param path: Path of the snapshot file
+        """
+        self.path: str = path
+        self._entries = None  # {key: [value, expires_at as an ISO string]}
+        self._saved: dict = {}  # saves not yet merged into _entries, because the file hasn't been read yet
+        self._expired_before = None  # the latest now a save asked to drop expired entries at
+        self._loading = None
+        self._dirty: bool = False
+        self._writer = None
+
+    async def _load_all(self) -> dict:
+        if self._entries is None:
+            if self._loading is None:
+                self._loading = asyncio.get_event_loop().run_in_executor(None, self._read)
+            entries: dict = await self._loading
+            if self._entries is None:
+                self._entries = entries
+                self._merge()
+        return self._entries
+
+    def _merge(self):
+        self._entries.update(self._saved)
+        self._saved = {}
+        if self._expired_before is not None:
+            for expired in [key for key, (_, expires) in self._entries.items()
+                            if datetime.fromisoformat(expires) < self._expired_before]:
+                del self._entries[expired]
+            self._expired_before = None
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:  # a snapshot from an older layout or a damaged file is just started over
+            error_log.record('snapshot_read', exc_info=e, Path=self.path)
+            return {}
+
+    async def load(self, key: str):
+        """Returns the saved value of key and when it expires
+
+        :param key: The cache key, as a string
+        :return: (value, datetime) or None if nothing is saved under key
+        """
+        entry: list = (await self._load_all()).get(key)
+        if entry is None:
+            return None
+        return entry[0], datetime.fromisoformat(entry[1])
+
+    def save(self, key: str, value, expires_at: datetime, now: datetime = None):
+        """Saves the value of key, writing the snapshot in the background. Entries that expired before now are
+        dropped at the same time
+
+        :param key: The cache key, as a string
+        :param value: Anything json can encode
+        :param expires_at: When the value stops being valid
+        :param now: (Optional) The time entries are considered expired at, defaults to never dropping any
+        """
+        self._saved[key] = [value, expires_at.isoformat()]
+        if now is not None:
+            self._expired_before = max(self._expired_before or now, now)
+        if self._entries is not None:  # otherwise merged once the file has been read, keeping what's on disk
+            self._merge()
+        self._dirty = True
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.ensure_future(self._write())
+
+    async def _write(self):
+        loop = asyncio.get_event_loop()
+        await self._load_all()
+        while self._dirty:  # saves made while a write is running are picked up by the next pass
+            self._dirty = False
+            self._merge()
+            # the values themselves are only ever replaced, so a shallow copy is safe to encode on another thread
+            entries: dict = dict(self._entries)
+            try:
+                await loop.run_in_executor(None, self._replace, entries)
+            except (OSError, ValueError) as e:
+                error_log.record('snapshot_write', exc_info=e, Path=self.path)
+
+    def _replace(self, entries: dict):
+        temporary: str = self.path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(entries, f, separators=(',', ':'))
+        os.replace(temporary, self.path)
+
+    async def coalesce(self, key: str, fetch, is_current):
+        """Fetches the value of key. Only this process uses the snapshot, and the caches already make sure a key
+        is fetched once at a time, so there is nothing to coordinate
+
+        :return: What fetch returns
+        """
+        return await fetch()
+
+    async def flush(self):
+        """Waits until every save so far is on disk
+        """
+        if self._writer is not None:
+            await self._writer
+
+    async def clear(self):
+        """Forgets every entry and deletes the snapshot file
+        """
+        await self.flush()  # a write still running would bring the file back
+        self._entries = {}
+        self._saved = {}
+        self._expired_before = None
+        self._dirty = False
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
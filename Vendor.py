@@ -1,22 +1,85 @@
-import time
-from datetime import datetime, timedelta
-import datetime as DT
-import dateutil.relativedelta as REL
+import asyncio
+from datetime import datetime, timezone
 import os
+import aiohttp
 import discord
-import requests
-import sqlite3
 from dotenv import load_dotenv
 
-from helpers import hyperlink, Emoji
-from pybungie import BungieAPI, VendorHash, Definitions, Components, MembershipType, PlayerClass, DamageType
+from AuthManager import AuthManager
+from BungieClient import BungieClient, BungieAPIError
+from Database import DestinyDatabase
+from ErrorLog import error_log
+from HTTPCache import HTTPCache
+from Manifest import Manifest
+from Metrics import metrics
+from RequestScheduler import background
+from ResponseCache import ResponseCache
+from SharedStore import SharedStore
+from Snapshot import Snapshot
+from helpers import hyperlink, format_duration, format_eastern, Emoji
+from reset_calendar import next_daily_reset, next_xur_arrival, utc_now, week_of, XurCalendar
+from pybungie import VendorHash, Definitions, Components, MembershipType, PlayerClass, DamageType
 
 load_dotenv()
 LOCATION_ROOT_PATH: str = 'https://paracausal.science/xur/current.json'  # credit to to @nev_rtheless
-bungie_api = BungieAPI(api_key=os.getenv("API_KEY"))
-bungie_api.input_xbox_credentials(xbox_live_email=os.getenv("XBOX_LIVE_EMAIL"),
-                                  xbox_live_password=os.getenv("XBOX_LIVE_PASSWORD"))
-bungie_api.start_oauth2(client_id=os.getenv("CLIENT_ID"), client_secret=os.getenv("CLIENT_SECRET"))
+auth = AuthManager(api_key=os.getenv("API_KEY"), client_id=os.getenv("CLIENT_ID"),
+                   client_secret=os.getenv("CLIENT_SECRET"), path=os.getenv('TOKENS_PATH', 'tokens.json'),
+                   xbox_live_email=os.getenv("XBOX_LIVE_EMAIL"), xbox_live_password=os.getenv("XBOX_LIVE_PASSWORD"))
+bungie_client = BungieClient(api_key=os.getenv("API_KEY"), auth=auth)
+manifest = Manifest(client=bungie_client)
+database = DestinyDatabase()
+# bot processes sharing a machine share one cache, so adding shards doesn't add requests to Bungie.NET
+snapshot = SharedStore(os.getenv('SHARED_CACHE_PATH')) if os.getenv('SHARED_CACHE_PATH') \
+    else Snapshot(os.getenv('SNAPSHOT_PATH', 'snapshot.json'))
+response_cache = ResponseCache(store=snapshot)
+http_cache = HTTPCache(client=bungie_client, store=snapshot)
+
+
+async def vendor_sales() -> dict:
+    """Returns the sale items of every vendor, all of them fetched with a single request per daily reset so every
+    vendor is built from the same snapshot
+
+    :return: dict - {'vendor_hash': {'saleItems': {...}}}
+    """
+    return await response_cache.get('sales', _fetch_vendor_sales, next_daily_reset(), allow_stale=False)
+
+
+def refresh_vendor_sales() -> asyncio.Future:
+    """Fetches the sale items of every vendor again, swapping them into the cache once they have all arrived
+
+    :return: asyncio.Future resolving to what vendor_sales() returns
+    """
+    return response_cache.refresh('sales', _fetch_vendor_sales, next_daily_reset(), force=True)
+
+
+async def _fetch_vendor_sales() -> dict:
+    vendors: dict = await bungie_client.get_vendors(membership_type=MembershipType.STEAM,
+                                                    membership_id=int(os.getenv("MEMBERSHIP_ID")),
+                                                    character_id=int(os.getenv("CHARACTER_ID")),
+                                                    components=Components.VendorSales)
+    return vendors['sales']['data']
+
+
+def record_history(vendor_hash: VendorHash, items: list, item_type: str, class_type: str = None):
+    """Appends what a vendor is selling this week to the history in the background, without holding up the caller
+
+    :param vendor_hash: The vendor selling the items
+    :param items: dicts with at least 'name' and 'hash', and the keys named by item_type and class_type
+    :param item_type: Key of each item's type
+    :param class_type: (Optional) Key of each item's class
+    """
+    now: datetime = utc_now()
+    week: str = week_of(now)
+    rows: list = [{'vendor': vendor_hash.value, 'week': week, 'item_hash': item['hash'], 'name': item['name'],
+                   'item_type': item[item_type], 'class_type': item[class_type] if class_type else None,
+                   'seen_at': now.isoformat(timespec='seconds')} for item in items]
+    task: asyncio.Future = asyncio.ensure_future(database.record_history(rows))
+    task.add_done_callback(_report_history_failure)
+
+
+def _report_history_failure(task: asyncio.Future):
+    if not task.cancelled() and task.exception() is not None:
+        error_log.record('history_write', exc_info=task.exception())
 
 
 def Vendor(name: str):
@@ -40,16 +103,23 @@ class RegularVendor:
             if self.hash_id is None or self.hash_id is VendorHash.TESS_EVERIS:
                 raise RuntimeError
 
-        displayProperties: dict = bungie_api.manifest((Definitions['VENDOR']).value, self.hash_id.value)['displayProperties']
+        self.name = None  # display properties are read from the manifest by load()
+        self.subtitle = None
+        self.description = None
+        self.icon = None
+        self.membership_id: int = int(os.getenv("MEMBERSHIP_ID"))
+        self.character_id: int = int(os.getenv("CHARACTER_ID"))
+
+    async def load(self):
+        """Reads the vendor's display properties from the manifest, only the first call does any work
+        """
+        if self.name is not None:
+            return
+        displayProperties: dict = (await manifest.get(Definitions['VENDOR'], self.hash_id.value))['displayProperties']
         self.name: str = displayProperties['name']
         self.subtitle: str = displayProperties['subtitle']
         self.description: str = displayProperties['description']
         self.icon: str = displayProperties['smallTransparentIcon']
-        self.membership_id: int = int(os.getenv("MEMBERSHIP_ID"))
-        self.character_id: int = int(os.getenv("CHARACTER_ID"))
-        self.days_between_refresh: int = 5
-        self.cache_check = None
-        self.cached_message = None
 
     def create_embed_title(self) -> discord.Embed:
         embed: discord.Embed = discord.Embed(
@@ -59,16 +129,14 @@ class RegularVendor:
         )
         return embed
 
-    def message(self):
+    @metrics.timed('vendor_seconds', 'Time spent building vendor responses', operation='message')
+    async def message(self):
         """Creates an Embed that contains the vendors current bounties, or a generic response if they are not available
 
         :return: string or discord.Embed
         """
-        today: datetime = DT.datetime.today()
-        if self.cached_message and today < self.cache_check:
-            return self.cached_message
-
-        weekly_bounties, daily_bounties = self.items()
+        await self.load()
+        weekly_bounties, daily_bounties = await self.inventory()
         embed: discord.Embed = self.create_embed_title()
         embed.set_thumbnail(url=f'https://www.bungie.net/{self.icon}')
 
@@ -87,30 +155,47 @@ class RegularVendor:
         if not daily_bounties and not weekly_bounties:
             raise RuntimeError
 
-        self.cached_message: discord.Embed = embed
-        if today.hour < 12:
-            self.cache_check: datetime = today.replace(hour=12, minute=0, second=0, microsecond=0)
-        else:
-            self.cache_check: datetime = today.replace(hour=12, minute=0, second=0, microsecond=0) + timedelta(days=1)
-        return self.cached_message
+        return embed
+
+    def next_reset(self) -> datetime:
+        """Returns the reset the vendor's current inventory is valid until
+
+        :return: datetime
+        """
+        return next_daily_reset()
+
+    async def inventory(self):
+        """Returns the result of items() through the shared response cache
+
+        :return: Whatever items() returns
+        """
+        return await response_cache.get(self.hash_id.value, self.items, self.next_reset())
+
+    async def refresh(self):
+        """Fetches the vendor's inventory again, the cached one keeps being served until the new one is complete
+        """
+        await response_cache.refresh(self.hash_id.value, self.items, self.next_reset(), force=True)
 
-    def items(self) -> (list, list):
+    @metrics.timed('vendor_seconds', 'Time spent building vendor responses', operation='items')
+    async def items(self) -> (list, list):
         daily_bounties: list = []
         weekly_bounties: list = []
-        curr_vendor: dict = bungie_api.get_vendor(membership_type=MembershipType.STEAM,
-                                            membership_id=self.membership_id,
-                                            character_id=self.character_id, vendor_hash=self.hash_id,
-                                            components=Components.VendorSales)
-        items: dict = curr_vendor['sales']['data']
-        db = sqlite3.connect('destiny.db')
-        db.row_factory = sqlite3.Row
-        for item in items.values():
-            hash_id: int = item['itemHash']
-            db_item = db.execute("SELECT * FROM bounties WHERE hash=?", (hash_id,)).fetchone()
-            if db_item:
-                bounty_dict: dict = dict(db_item)
+        sales: dict = await vendor_sales()
+        if str(self.hash_id.value) not in sales:  # the vendor isn't selling anything to our character right now
+            return weekly_bounties, daily_bounties
+        items: dict = sales[str(self.hash_id.value)]['saleItems']
+        hashes: list = [item['itemHash'] for item in items.values()]
+        db_items: dict = await database.bounties(hashes)
+
+        # unknown bounties come from the local manifest, anything it lacks is requested concurrently
+        definitions: dict = await manifest.get_many(Definitions['ITEM'],
+                                                    [hash_id for hash_id in hashes if hash_id not in db_items])
+        new_bounties: list = []
+        for hash_id in hashes:
+            if hash_id in db_items:
+                bounty_dict: dict = db_items[hash_id]
             else:
-                bounty: dict = bungie_api.manifest((Definitions['ITEM']).value, hash_id)
+                bounty: dict = definitions[hash_id]
                 displayProperties: dict = bounty['displayProperties']
                 bounty_dict: dict = {
                     'name': displayProperties['name'],
@@ -119,51 +204,59 @@ class RegularVendor:
                     'hash': hash_id
                 }
                 if "Bounty" in bounty_dict['bountyType']:
-                    db.execute("INSERT INTO bounties VALUES (:name, :description, :bountyType, :hash)", bounty_dict)
-                    db.commit()
+                    new_bounties.append(bounty_dict)
 
             bounty_type: str = bounty_dict['bountyType']
             if "Daily" in bounty_type:
                 daily_bounties.append(bounty_dict)
             if "Weekly" in bounty_type:
                 weekly_bounties.append(bounty_dict)
-        db.close()
+        await database.save_bounties(new_bounties)
+        record_history(self.hash_id, weekly_bounties + daily_bounties, item_type='bountyType')
         return weekly_bounties, daily_bounties
 
 
 class Xur(RegularVendor):
     def __init__(self, name: str):
         super().__init__(name)
-        self.days_between_refresh = 3
+        self.calendar: XurCalendar = XurCalendar()
         self.embedded = False
+        self._confirmation = None
 
-    def message(self):
+    def next_reset(self) -> datetime:
+        return self.calendar.window()[1]
+
+    async def refresh(self):
+        await asyncio.gather(super().refresh(), self.location())
+
+    @metrics.timed('vendor_seconds', 'Time spent building vendor responses', operation='xur_message')
+    async def message(self):
         """Creates an Embed that contains Xur's inventory, or a generic response if Xur is not available
 
         :return: string or discord.Embed
         """
-        next_refresh = self.get_next_refresh()
-        leaving_time = self.get_time_until_refresh(next_refresh=next_refresh)
-
-        today: DT.date = DT.date.today()
-        next_friday: DT.date = today + REL.relativedelta(weekday=REL.FR)
-        curr_time: int = time.localtime().tm_hour
-
-        if leaving_time.total_seconds() < 0 or (today == next_friday and curr_time < 12):
+        now: datetime = utc_now()
+        if self.calendar.needs_confirmation(now) and (self._confirmation is None or self._confirmation.done()):
+            self.calendar.attempt(now)
+            with background():
+                self._confirmation = asyncio.ensure_future(self.confirm_schedule())
+
+        arrival, departure = self.calendar.window(now)
+        if not arrival <= now < departure:
             self.embedded: bool = False
-            self.cached_message: str = "*I will return on Friday guardian*\n Try again on " + next_friday.strftime(
-                "%B, %d %Y") + " at 12pm EST"
-            return self.cached_message
+            return "*I will return on Friday guardian*\n Try again on " + format_eastern(arrival)
 
-        if next_refresh == self.cache_check and self.embedded:
-            return self.cached_message
+        loaded, inventory, location = await asyncio.gather(
+            self.load(), self.inventory(), self.location(), return_exceptions=True)
 
         try:
+            for result in (loaded, inventory, location):
+                if isinstance(result, Exception):
+                    raise result
             embed: discord.Embed = self.create_embed_title()
             embed.clear_fields()
-            inventory: dict = self.items()
             embed.set_thumbnail(url='https://www.bungie.net/' + self.icon)
-            embed.add_field(name="**Location**", value=self.location(), inline=False)
+            embed.add_field(name="**Location**", value=location, inline=False)
             embed.add_field(name=Emoji[inventory['UNKNOWN']['damageType']].value + " **Weapon**",
                             value=hyperlink(inventory['UNKNOWN']), inline=True)
             embed.add_field(name="\u200b", value="\u200b", inline=True)
@@ -180,40 +273,41 @@ class Xur(RegularVendor):
                             inline=True)
             embed.add_field(name="\u200b", value="\u200b", inline=True)
             embed.add_field(name="\u200b", value=inventory['WARLOCK']['type'], inline=True)
-            embed.set_footer(
-                text='I will be leaving in ' + str(leaving_time)[:-10].replace(':', ' hours, and ') + ' minutes')
+            embed.set_footer(text='I will be leaving in ' + format_duration(departure - now))
             self.embedded = True
-            self.cache_check = next_refresh
-            self.cached_message = embed
-            return self.cached_message
+            return embed
         except KeyError:
             self.embedded = False
-            return "*I will return on Friday guardian*\nTry again on " + next_friday.strftime(
-                "%B, %d %Y") + " at 12pm EST"
+            return "*I will return on Friday guardian*\nTry again on " + format_eastern(next_xur_arrival(now))
 
-    def items(self) -> dict:
+    @metrics.timed('vendor_seconds', 'Time spent building vendor responses', operation='xur_items')
+    async def items(self) -> dict:
         """Retrieve a vendor's inventory
 
         :return: dict -
             {'class_type': {'name': 'item_name', 'type': 'item_type', 'hash': 'item_hash', 'damageType': 'damage_type'}}
         """
         inventory: dict = {}
-        my_items: dict = bungie_api.get_public_vendors(components=Components.VendorSales)['sales']['data'][str(self.hash_id.value)]['saleItems']
-
-        db: sqlite3.Connection = sqlite3.connect('destiny.db')
-        db.row_factory = sqlite3.Row
+        my_items: dict = (await bungie_client.get_public_vendors(components=Components.VendorSales))['sales']['data'][str(self.hash_id.value)]['saleItems']
 
         # For each item they're selling, find it's name, type, hash and class type
+        hashes: list = []
         for item, count in zip(my_items, range(5)):
             item_hash: int = my_items[item]['itemHash']  # current item hash
             if item_hash == 3875551374:  # check if its an engram
                 continue
-            db_item = db.execute("SELECT * FROM items WHERE hash=?", (item_hash,)).fetchone()
-            if db_item:
-                db_item: dict = dict(db_item)
+            hashes.append(item_hash)
+        db_items: dict = await database.items(hashes)
+
+        definitions: dict = await manifest.get_many(Definitions['ITEM'],
+                                                    [item_hash for item_hash in hashes if item_hash not in db_items])
+        new_items: list = []
+        for item_hash in hashes:
+            if item_hash in db_items:
+                db_item: dict = db_items[item_hash]
                 inventory[db_item['classType']]: dict = db_item
             else:
-                item_info: dict = bungie_api.manifest(entity_type=(Definitions['ITEM']).value, hash_identifier=item_hash)
+                item_info: dict = definitions[item_hash]
 
                 # create dictionary for current item
                 item_dict: dict = {
@@ -223,39 +317,47 @@ class Xur(RegularVendor):
                     'damageType': (DamageType(item_info['defaultDamageType'])).name,
                     'classType': (PlayerClass(item_info['classType'])).name
                 }
-
-                db.execute("INSERT INTO items VALUES (:name, :type, :hash, :damageType, :classType)", item_dict)
-                db.commit()
+                new_items.append(item_dict)
                 inventory[item_dict['classType']] = item_dict
-        db.close()
+        await database.save_items(new_items)
+        record_history(self.hash_id, list(inventory.values()), item_type='type', class_type='classType')
         return inventory
 
-    def get_next_refresh(self) -> [datetime, str]:
-        """Returns Vendors next refresh date, or empty string
+    @metrics.timed('vendor_seconds', 'Time spent building vendor responses', operation='next_refresh')
+    async def get_next_refresh(self) -> datetime:
+        """Returns Vendors next refresh date, or None if the API can't tell us
 
-        :return: datetime or str
+        :return: datetime or None
         """
         try:
-            next_refresh_date: datetime = datetime.strptime(
-                (bungie_api.get_vendor(membership_type=MembershipType.STEAM,
-                                       membership_id=int(os.getenv("MEMBERSHIP_ID")),
-                                       character_id=int(os.getenv("CHARACTER_ID")), vendor_hash=self.hash_id,
-                                       components=Components.Vendors)['vendor']['data']['nextRefreshDate']),
-                '%Y-%m-%dT%H:%M:%SZ')
-            return next_refresh_date
-        except:
-            return ''
-
-    def get_time_until_refresh(self, next_refresh: datetime) -> timedelta:
-        return next_refresh - timedelta(days=self.days_between_refresh, hours=4) - datetime.now()
-
-    def location(self) -> str:
-        """Returns a Xur's location
+            vendor: dict = await bungie_client.get_vendor(membership_type=MembershipType.STEAM,
+                                                          membership_id=self.membership_id,
+                                                          character_id=self.character_id, vendor_hash=self.hash_id,
+                                                          components=Components.Vendors)
+            return datetime.strptime(vendor['vendor']['data']['nextRefreshDate'],
+                                     '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+        except (BungieAPIError, KeyError, ValueError) as e:
+            error_log.record('xur_schedule', exc_info=e)
+            return None
+
+    async def confirm_schedule(self):
+        """Checks the locally worked out schedule against the refresh date the API reports
+        """
+        next_refresh = await self.get_next_refresh()
+        if next_refresh:
+            self.calendar.confirm(next_refresh)
+
+    @metrics.timed('vendor_seconds', 'Time spent building vendor responses', operation='location')
+    async def location(self) -> str:
+        """Returns a Xur's location, through the HTTP cache so it is only downloaded again when it has changed
 
         :return: str
         """
-        page: requests.Response = requests.get(LOCATION_ROOT_PATH)
-        json: dict = page.json()
-        return json['locationName']
+        try:
+            json: dict = await http_cache.get_json(LOCATION_ROOT_PATH, source='location')
+            return json['locationName']
+        except (aiohttp.ClientError, asyncio.TimeoutError, KeyError) as e:
+            error_log.record('xur_location', exc_info=e)
+            return 'Unknown'
 
 
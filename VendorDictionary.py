@@ -1,70 +1,54 @@
 from pybungie import VendorHash
-from collections import defaultdict
-import bisect
+import asyncio
+from RequestScheduler import background
 from Vendor import Vendor
+from VendorIndex import VendorIndex
 
 
 class VendorDictionary:
     def __init__(self):
-        vendor_dict = {}
-        for vendor in VendorHash:
-            vendor_dict[vendor.name.replace('_', ' ')] = Vendor(name=vendor.name)
-
-        self.prefixes = defaultdict(dict)
-        self.suffixes = {}
-        self.full_vendor_dict = {}
-        for key in vendor_dict:
-            if len(key.split()) == 2:
-                prefix, suffix = key.split()
-                self.suffixes[suffix] = vendor_dict[key]
-                self.prefixes[prefix].update({suffix: vendor_dict[key]})
-                self.prefixes[prefix] = dict(sorted(self.prefixes[prefix].items()))
-            else:
-                for token in key.split():
-                    self.full_vendor_dict[token] = vendor_dict[key]
-
-        self.suffixes['BANSHEE'] = self.suffixes['44']
-        self.suffixes['SAINT'] = self.suffixes['14']
-        del self.suffixes['14'], self.suffixes['44']
-        self.suffixes = dict(sorted(self.suffixes.items()))
-        self.prefixes = dict(sorted(self.prefixes.items()))
-        self.full_vendor_dict = dict(sorted(self.full_vendor_dict.items()))
+        # the index only holds VendorHash members, vendor objects are created the first time they are looked up
+        self.index = VendorIndex()
+        self.vendors = {}
+
+    def vendor(self, vendor_hash: VendorHash):
+        """Returns the vendor object for a VendorHash, creating it on first use
+
+        :param vendor_hash: The hash of the vendor
+        :return: RegularVendor, Xur or None if the vendor can't be created
+        """
+        if vendor_hash is None:
+            return None
+        if vendor_hash not in self.vendors:
+            try:
+                self.vendors[vendor_hash] = Vendor(name=vendor_hash.name)
+            except RuntimeError:
+                return None
+        return self.vendors[vendor_hash]
+
+    async def warm_up(self):
+        """Creates every vendor and loads its display properties, a vendor that fails is left to be retried on
+        its next lookup. Its requests give way to the ones users are waiting on
+        """
+        vendors = [self.vendor(vendor_hash) for vendor_hash in VendorHash]
+        vendors = [vendor for vendor in vendors if vendor is not None]
+        with background():
+            results = await asyncio.gather(*(vendor.load() for vendor in vendors), return_exceptions=True)
+        for vendor, result in zip(vendors, results):
+            if isinstance(result, Exception):
+                del self.vendors[vendor.hash_id]
 
     def search(self, name: str):
-        name = name.upper()
-        try:
-            if ' ' in name:
-                prefix, suffix = name.split()
-                return self.__check_prefix(prefix=prefix, suffix=suffix)
-            else:
-                return self.__check_suffix(suffix=name)
-        except KeyError:
-            return self.__check_full_vendor_dict(name=name)
+        """Returns the vendor that best matches name
 
-    def __check_prefix(self, prefix: str, suffix: str):
-        prefix = self.__binary_search(key=prefix, dictionary=self.prefixes)
-        if prefix is not None:
-            for value in self.prefixes[prefix].keys():
-                if suffix in value:
-                    return self.prefixes[prefix][suffix]
-        return None
+        :param name: A vendor name, part of one, an alias or a misspelling of one
+        :return: RegularVendor, Xur or None
+        """
+        return self.vendor(self.index.search(name))
 
-    def __check_suffix(self, suffix: str):
-        return self.suffixes[self.__binary_search(key=suffix, dictionary=self.suffixes)]
-
-    def __binary_search(self, key: str, dictionary: dict):
-        keys = list(dictionary.keys())
-        left_index = bisect.bisect_left(keys, key)
-        right_index = bisect.bisect_right(keys, key)
-        if left_index == right_index:
-            if left_index > len(keys) or keys[left_index] is not key:
-                return None
-            else:
-                return keys[left_index]
-        else:
-            return next(key for key in keys[left_index:right_index])
+    def candidates(self, name: str, limit: int = 5) -> list:
+        """Returns the vendors that match name, see VendorIndex.candidates
 
-    def __check_full_vendor_dict(self, name: str):
-        key = self.__binary_search(key=name, dictionary=self.full_vendor_dict)
-        if key is not None:
-            return self.full_vendor_dict[key]
\ No newline at end of file
+        :return: list - [(VendorHash, score)]
+        """
+        return self.index.candidates(name, limit=limit)
@@ -0,0 +1,141 @@
+from pybungie import VendorHash
+
+# other names players use for a vendor, on top of the words of the vendor's own name
+ALIASES: dict = {
+    'BANSHEE': VendorHash.BANSHEE_44,
+    'GUNSMITH': VendorHash.BANSHEE_44,
+    'SAINT': VendorHash.SAINT_14,
+    'TRIALS': VendorHash.SAINT_14,
+    'VANGUARD': VendorHash.COMMANDER_ZAVALA,
+    'CRUCIBLE': VendorHash.LORD_SHAXX,
+    'GAMBIT': VendorHash.THE_DRIFTER,
+    'CRYPTARCH': VendorHash.MASTER_RAHOOL,
+}
+
+FULL_NAME_SCORE: float = 1.0
+WORD_SCORE: float = 0.95
+MIN_SCORE: float = 0.4  # anything weaker is as likely to be some other word as a vendor
+MIN_PREFIX: int = 2  # a single letter is a prefix of too many names to mean any of them
+
+
+class VendorIndex:
+    def __init__(self, aliases: dict = None):
+        """Ranked vendor search over full names, the words of each name and aliases
+
+        Every key goes into a trie, and every suffix of every key into a second one, each node remembering the
+        vendors whose keys pass through it. Exact and prefix matches are a single walk of the first trie, substring
+        matches a single walk of the second, and typos are found by a bounded edit distance walk of the first.
+
+        :param aliases: (Optional) {alias: VendorHash}, defaults to ALIASES
+        """
+        self._keys: list = [{}]  # children of each node
+        self._terminal: list = [{}]  # {VendorHash: score} of the keys ending at each node
+        self._below: list = [{}]  # {VendorHash: length of the shortest key} under each node
+        self._suffixes: list = [{}]
+        self._suffix_below: list = [{}]
+
+        for vendor in VendorHash:
+            name: str = vendor.name.replace('_', ' ')
+            self._insert(name, vendor, FULL_NAME_SCORE)
+            for word in name.split():
+                self._insert(word, vendor, WORD_SCORE)
+        for alias, vendor in (ALIASES if aliases is None else aliases).items():
+            self._insert(alias, vendor, WORD_SCORE)
+
+    @staticmethod
+    def _walk(children: list, below: list, key: str, vendor: VendorHash, length: int) -> int:
+        node: int = 0
+        for char in key:
+            if char not in children[node]:
+                children[node][char] = len(children)
+                children.append({})
+                below.append({})
+            node = children[node][char]
+            below[node][vendor] = min(below[node].get(vendor, length), length)
+        return node
+
+    def _insert(self, key: str, vendor: VendorHash, score: float):
+        node: int = self._walk(self._keys, self._below, key, vendor, len(key))
+        while len(self._terminal) < len(self._keys):
+            self._terminal.append({})
+        self._terminal[node][vendor] = max(self._terminal[node].get(vendor, 0), score)
+        for start in range(1, len(key)):
+            self._walk(self._suffixes, self._suffix_below, key[start:], vendor, len(key))
+
+    @staticmethod
+    def _find(children: list, query: str) -> int:
+        node: int = 0
+        for char in query:
+            node = children[node].get(char)
+            if node is None:
+                return None
+        return node
+
+    def candidates(self, query: str, limit: int = 5) -> list:
+        """Ranks the vendors that match a query
+
+        :param query: A vendor name, part of one, or a misspelling of one
+        :param limit: The maximum number of candidates returned
+        :return: list - [(VendorHash, score)] best first, scores are between 0 and 1
+        """
+        query = ' '.join(query.upper().replace('_', ' ').split())
+        scores: dict = self._score(query)
+        if not scores and ' ' in query:  # fall back to matching each word on its own
+            words: list = query.split()
+            for word in words:
+                if len(word) < MIN_PREFIX:  # still counted in the average, but can't match anything by itself
+                    continue
+                for vendor, score in self._score(word).items():
+                    scores[vendor] = scores.get(vendor, 0) + score / len(words)
+        ranked: list = sorted(scores.items(), key=lambda candidate: candidate[1], reverse=True)[:limit]
+        return [(vendor, round(score, 3)) for vendor, score in ranked]
+
+    def search(self, query: str):
+        """Returns the best match for a query, unless even that is too weak to be what was meant
+
+        :param query: A vendor name, part of one, or a misspelling of one
+        :return: VendorHash or None
+        """
+        candidates: list = self.candidates(query, limit=1)
+        return candidates[0][0] if candidates and candidates[0][1] >= MIN_SCORE else None
+
+    def _score(self, query: str) -> dict:
+        if not query:
+            return {}
+        scores: dict = {}
+        node = self._find(self._keys, query)
+        if node is not None:
+            for vendor, score in self._terminal[node].items():
+                scores[vendor] = score
+            for vendor, length in self._below[node].items() if len(query) >= MIN_PREFIX else ():  # prefix matches
+                scores[vendor] = max(scores.get(vendor, 0), 0.6 + 0.3 * len(query) / length)
+        if len(query) >= 3:
+            node = self._find(self._suffixes, query)
+            if node is not None:
+                for vendor, length in self._suffix_below[node].items():
+                    scores[vendor] = max(scores.get(vendor, 0), 0.3 + 0.2 * len(query) / length)
+        if not scores and len(query) >= 3:
+            for vendor, distance in self._near(query, 1 if len(query) <= 4 else 2).items():
+                scores[vendor] = 0.55 - 0.1 * distance
+        return scores
+
+    def _near(self, query: str, max_distance: int) -> dict:
+        """Finds the keys within max_distance edits of query by walking the trie one row of the Levenshtein table
+        per node, abandoning every branch whose row is already over the limit
+
+        :return: dict - {VendorHash: distance}
+        """
+        found: dict = {}
+        stack: list = [(child, char, list(range(len(query) + 1))) for char, child in self._keys[0].items()]
+        while stack:
+            node, char, previous = stack.pop()
+            row: list = [previous[0] + 1]
+            for column in range(1, len(query) + 1):
+                row.append(min(row[column - 1] + 1, previous[column] + 1,
+                               previous[column - 1] + (query[column - 1] != char)))
+            if row[-1] <= max_distance:
+                for vendor in self._terminal[node]:
+                    found[vendor] = min(found.get(vendor, row[-1]), row[-1])
+            if min(row) <= max_distance:
+                stack.extend((child, next_char, row) for next_char, child in self._keys[node].items())
+        return found
@@ -0,0 +1,53 @@
+"""Compares two benchmark result files written by benchmarks.run
+
+    python -m benchmarks.compare before.json after.json --threshold 0.2
+
+Exits with status 1 if any scenario's p50 or p99 got slower by more than the threshold.
+"""
+import argparse
+import json
+import sys
+
+METRICS: tuple = ('p50_ms', 'p99_ms')
+
+
+def compare(before: dict, after: dict, threshold: float) -> (list, list):
+    """Returns a row per scenario and metric found in both runs, and the rows that regressed
+
+    :return: (list, list) - rows of (scenario, metric, before, after, relative change)
+    """
+    rows: list = []
+    regressions: list = []
+    for scenario, result in after['results'].items():
+        if scenario not in before['results']:
+            continue
+        for metric in METRICS:
+            old, new = before['results'][scenario][metric], result[metric]
+            change: float = (new - old) / old if old else 0.0
+            rows.append((scenario, metric, old, new, change))
+            if change > threshold:
+                regressions.append(rows[-1])
+    return rows, regressions
+
+
+def main():
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative slowdown counted as a regression')
+    args = parser.parse_args()
+    with open(args.before) as f:
+        before: dict = json.load(f)
+    with open(args.after) as f:
+        after: dict = json.load(f)
+
+    rows, regressions = compare(before, after, args.threshold)
+    print(f'{before.get("commit")} -> {after.get("commit")}')
+    for scenario, metric, old, new, change in rows:
+        flag: str = '  REGRESSION' if (scenario, metric, old, new, change) in regressions else ''
+        print(f'{scenario:<32}{metric:<8}{old:>12.4f}{new:>12.4f}{change:>+10.1%}{flag}')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
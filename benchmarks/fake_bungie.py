@@ -0,0 +1,134 @@
+import asyncio
+import io
+import json
+import os
+import re
+import socket
+import sqlite3
+import tempfile
+import threading
+import zipfile
+
+from aiohttp import web
+
+FIXTURES: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# (pattern of the request path, fixture replayed as the 'Response' of a Bungie envelope)
+ROUTES: list = [
+    (re.compile(r'^/Platform/Destiny2/\d+/Profile/\d+/Character/\d+/Vendors/\d+/$'), 'vendor.json'),
+    (re.compile(r'^/Platform/Destiny2/\d+/Profile/\d+/Character/\d+/Vendors/$'), 'vendors.json'),
+    (re.compile(r'^/Platform/Destiny2//?Vendors/$'), 'public_vendors.json'),
+    (re.compile(r'^/Platform/Destiny2/Manifest/$'), 'manifest.json'),
+]
+DEFINITION_ROUTE = re.compile(r'^/Platform/Destiny2/Manifest/(\w+)/(\d+)/?$')
+LOCATION_ETAG: str = '"xur-location-1"'
+
+
+def load(name: str):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return json.load(f)
+
+
+def content_database(definitions: dict) -> bytes:
+    """Builds a zipped manifest content database, laid out like Bungie's, out of the recorded definitions
+
+    :return: bytes
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path: str = os.path.join(directory, 'world.content')
+        db: sqlite3.Connection = sqlite3.connect(path)
+        for table, entities in definitions.items():
+            db.execute(f'CREATE TABLE {table} (id INTEGER PRIMARY KEY NOT NULL, json BLOB)')
+            db.executemany(f'INSERT INTO {table} VALUES (?, ?)',
+                           [(int(h) - (1 << 32) if int(h) >= (1 << 31) else int(h), json.dumps(entity))
+                            for h, entity in entities.items()])
+        db.commit()
+        db.close()
+        archive: io.BytesIO = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as z:
+            z.write(path, 'world.content')
+        return archive.getvalue()
+
+
+class FakeBungie:
+    def __init__(self, latency: float = 0.05):
+        """Local stand-in for the Bungie.NET API, its content server and the Xur location feed, replaying the
+        recorded responses in benchmarks/fixtures after a configurable delay
+
+        :param latency: Seconds every response is delayed by
+        """
+        self.latency: float = latency
+        self.calls: dict = {}
+        self.definitions: dict = load('definitions.json')
+        self.manifest: dict = load('manifest.json')
+        self.content: bytes = content_database(self.definitions)
+        self.url = None
+        self._loop = None
+        self._runner = None
+
+    def count(self, name: str):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    async def handle(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.latency)
+        path: str = request.path
+        if path == '/xur/current.json':  # answers conditional requests the way the real site does
+            if request.headers.get('If-None-Match') == LOCATION_ETAG:
+                self.count('location_not_modified')
+                return web.Response(status=304, headers={'ETag': LOCATION_ETAG, 'Cache-Control': 'max-age=60'})
+            self.count('location')
+            return web.json_response(load('location.json'),
+                                     headers={'ETag': LOCATION_ETAG, 'Cache-Control': 'max-age=60'})
+        if path == self.manifest['mobileWorldContentPaths']['en']:
+            self.count('content')
+            return web.Response(body=self.content)
+        match = DEFINITION_ROUTE.match(path)
+        if match:
+            self.count('definition')
+            entity = self.definitions.get(match.group(1), {}).get(match.group(2))
+            return self.envelope(entity) if entity else self.error(1618, 'DestinyDefinitionNotFound')
+        for pattern, fixture in ROUTES:
+            if pattern.match(path):
+                self.count(fixture[:-5])
+                return self.envelope(load(fixture))
+        return web.Response(status=404)
+
+    @staticmethod
+    def envelope(response) -> web.Response:
+        return web.json_response({'Response': response, 'ErrorCode': 1, 'ThrottleSeconds': 0,
+                                  'ErrorStatus': 'Success', 'Message': 'Ok', 'MessageData': {}})
+
+    @staticmethod
+    def error(code: int, status: str) -> web.Response:
+        return web.json_response({'ErrorCode': code, 'ThrottleSeconds': 0, 'ErrorStatus': status,
+                                  'Message': status, 'MessageData': {}})
+
+    def start(self) -> str:
+        """Serves on a free localhost port from a thread of its own, so the server's work doesn't share the event
+        loop being measured
+
+        :return: str - the root url of the server
+        """
+        started: threading.Event = threading.Event()
+        threading.Thread(target=self._serve, args=(started,), daemon=True).start()
+        started.wait()
+        return self.url
+
+    def _serve(self, started: threading.Event):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        app: web.Application = web.Application()
+        app.router.add_route('GET', '/{tail:.*}', self.handle)
+        self._runner = web.AppRunner(app)
+        self._loop.run_until_complete(self._runner.setup())
+        sock: socket.socket = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        self._loop.run_until_complete(web.SockSite(self._runner, sock).start())
+        self.url = f'http://127.0.0.1:{sock.getsockname()[1]}'
+        started.set()
+        self._loop.run_forever()
+
+    def stop(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
@@ -0,0 +1,60 @@
+import itertools
+
+_ids = itertools.count(1)
+
+
+class FakeUser:
+    def __init__(self, name: str = 'Guardian', bot: bool = False):
+        self.id: int = next(_ids)
+        self.name: str = name
+        self.bot: bool = bot
+        self.mention: str = f'<@{self.id}>'
+
+    def __str__(self):
+        return self.name
+
+
+class FakeChannel:
+    def __init__(self, name: str = 'general'):
+        """Records what the bot sends and deletes instead of talking to Discord
+        """
+        self.id: int = next(_ids)
+        self.name: str = name
+        self.sent: list = []
+
+    def __str__(self):
+        return self.name
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content if content is not None else kwargs.get('embed'))
+
+
+class FakeMessage:
+    def __init__(self, content: str, channel: FakeChannel = None, author: FakeUser = None):
+        self.id: int = next(_ids)
+        self.content: str = content
+        self.channel: FakeChannel = channel or FakeChannel()
+        self.author: FakeUser = author or FakeUser()
+        self.guild = None
+        self._state = None  # commands.Context copies it, nothing reads it for messages that aren't commands
+        self.reactions: list = []
+        self.deleted: bool = False
+
+    async def add_reaction(self, emoji):
+        self.reactions.append(emoji)
+
+    async def delete(self, **kwargs):
+        self.deleted = True
+
+
+class FakeContext:
+    def __init__(self, message: FakeMessage = None):
+        """Stands in for commands.Context when a command's callback is invoked directly
+        """
+        self.message: FakeMessage = message or FakeMessage('')
+        self.channel: FakeChannel = self.message.channel
+        self.author: FakeUser = self.message.author
+        self.guild = None
+
+    async def send(self, content=None, **kwargs):
+        await self.channel.send(content, **kwargs)
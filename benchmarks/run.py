@@ -0,0 +1,231 @@
+"""Offline benchmarks for the bot's hot paths
+
+Runs every scenario against benchmarks.fake_bungie instead of Bungie.NET and prints the results as JSON:
+
+    python -m benchmarks.run --latency 0.05 --output results.json
+    python -m benchmarks.compare before.json after.json
+"""
+import argparse
+import asyncio
+import inspect
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+from benchmarks.fake_bungie import FakeBungie, FIXTURES
+from benchmarks.fakes import FakeContext, FakeMessage, FakeChannel, FakeUser
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SEARCHES: list = ['zavala', 'commander zavala', 'drifter', 'zavla', 'banshee', '44', 'lord shax', 'saint', 'xur',
+                  'hawthorne', 'nobody at all']
+
+CHATTER: list = ['hello there guardian', 'anyone up for raid tonight?', 'the weekly reset is soon',
+                 'this gun rolls are great', 'who is xur anyway', 'what are the nine', "i'm salty about trials",
+                 'shit this is hard', 'xur you are a damn cheat', 'benchslur', 'nice one', 'lfg nightfall']
+
+
+def summarize(timings: list, elapsed: float, calls: dict) -> dict:
+    """Latency percentiles in milliseconds, throughput and the upstream calls a scenario made
+
+    :return: dict
+    """
+    ordered: list = sorted(timings)
+    return {
+        'n': len(ordered),
+        'p50_ms': round(ordered[len(ordered) // 2] * 1000, 4),
+        'p99_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 4),
+        'mean_ms': round(statistics.mean(ordered) * 1000, 4),
+        'max_ms': round(ordered[-1] * 1000, 4),
+        'throughput_per_s': round(len(ordered) / elapsed, 2) if elapsed else None,
+        'upstream_calls': calls,
+    }
+
+
+class Benchmarks:
+    def __init__(self, fake: FakeBungie, iterations: int, messages: int):
+        import Vendor
+        import xur_bot
+        from reset_calendar import XurCalendar, utc_now
+
+        class PresentCalendar(XurCalendar):
+            """Keeps Xur in the middle of a visit so the benchmark measures the same path whatever the weekday"""
+            def window(self, now=None):
+                now = now or utc_now()
+                return now - timedelta(days=1), now + timedelta(days=2)
+
+        self.fake: FakeBungie = fake
+        self.iterations: int = iterations
+        self.messages: int = messages
+        self.vendor = Vendor
+        self.bot = xur_bot
+        self.bot.Xur.calendar = PresentCalendar()
+
+        # the bot never connects to the gateway, so it needs a user of its own and mustn't wait to become ready
+        async def ready():
+            return None
+        self.bot.client.wait_until_ready = ready
+        self.bot.client._connection.user = FakeUser('Xur', bot=True)
+
+    def calls_since(self, before: dict) -> dict:
+        return {name: count - before.get(name, 0) for name, count in self.fake.calls.items()
+                if count - before.get(name, 0)}
+
+    async def measure(self, name: str, action, iterations: int = None, before_each=None) -> dict:
+        timings: list = []
+        calls: dict = dict(self.fake.calls)
+        start: float = time.perf_counter()
+        for _ in range(iterations or self.iterations):
+            prepared = before_each() if before_each is not None else None
+            if inspect.isawaitable(prepared):
+                await prepared
+            began: float = time.perf_counter()
+            result = action()
+            if inspect.isawaitable(result):
+                await result
+            timings.append(time.perf_counter() - began)
+        return summarize(timings, time.perf_counter() - start, self.calls_since(calls))
+
+    async def flood(self, contents: list) -> dict:
+        """Delivers every message at once, the way a burst reaches on_message, and times each handler. The
+        throughput counts until every reply and deletion has been carried out
+
+        :return: dict
+        """
+        timings: list = []
+        calls: dict = dict(self.fake.calls)
+
+        async def deliver(message: FakeMessage):
+            began: float = time.perf_counter()
+            await self.bot.on_message(message)
+            timings.append(time.perf_counter() - began)
+
+        channels: list = [FakeChannel(f'channel-{index}') for index in range(8)]
+        start: float = time.perf_counter()
+        await asyncio.gather(*(deliver(FakeMessage(content, channel=random.choice(channels)))
+                               for content in contents))
+        await self.bot.pipeline.drain()
+        return summarize(timings, time.perf_counter() - start, self.calls_since(calls))
+
+    async def forget(self):
+        """Empties the response cache and its snapshot, as on the very first start"""
+        self.vendor.response_cache.clear()
+        self.vendor.http_cache.clear()
+        await self.vendor.snapshot.clear()
+
+    async def restart(self):
+        """Empties the response cache but keeps the snapshot on disk, as after a restart"""
+        from Snapshot import Snapshot
+
+        await self.vendor.snapshot.flush()
+        self.vendor.response_cache.clear()
+        self.vendor.http_cache.clear()
+        self.vendor.snapshot = Snapshot(self.vendor.snapshot.path)
+        self.vendor.response_cache.store = self.vendor.http_cache.store = self.vendor.snapshot
+
+    async def run(self, scenarios: list) -> dict:
+        from VendorDictionary import VendorDictionary
+
+        await self.vendor.manifest.sync()
+        contents: list = [random.choice(CHATTER) for _ in range(self.messages)]
+        searches, chatter = itertools.cycle(SEARCHES), itertools.cycle(contents)
+        every: dict = {
+            'vendor_dictionary_construction': lambda: self.measure('construction', VendorDictionary),
+            'vendor_dictionary_search': lambda: self.measure(
+                'search', lambda: self.bot.Vendor_Dictionary.search(next(searches)),
+                iterations=self.iterations * len(SEARCHES)),
+            'classify': lambda: self.measure(
+                'classify', lambda: self.bot.classifier.classify(next(chatter)), iterations=len(contents)),
+            'on_message_flood': lambda: self.flood(contents),
+            'xur_cold': lambda: self.measure('xur_cold', lambda: self.bot.xur.callback(FakeContext()),
+                                             before_each=self.forget),
+            'xur_restart': lambda: self.measure('xur_restart', lambda: self.bot.xur.callback(FakeContext()),
+                                                before_each=self.restart),
+            'xur_warm': lambda: self.measure('xur_warm', lambda: self.bot.xur.callback(FakeContext())),
+            'bounties_cold': lambda: self.measure(
+                'bounties_cold', lambda: self.bot.bounties.callback(FakeContext(), 'zavala'), before_each=self.forget),
+            'bounties_restart': lambda: self.measure(
+                'bounties_restart', lambda: self.bot.bounties.callback(FakeContext(), 'zavala'),
+                before_each=self.restart),
+            'bounties_warm': lambda: self.measure(
+                'bounties_warm', lambda: self.bot.bounties.callback(FakeContext(), 'zavala')),
+            'bounties_burst_after_reset': lambda: self.measure(
+                'burst', lambda: asyncio.gather(*(self.bot.bounties.callback(FakeContext(), 'zavala')
+                                                  for _ in range(25))), before_each=self.forget),
+        }
+        results: dict = {}
+        try:
+            for scenario in scenarios or every:
+                results[scenario] = await every[scenario]()
+        finally:
+            self.bot.pipeline.close()
+            await self.vendor.bungie_client.close()
+        return results
+
+
+def commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds the fake API takes to answer')
+    parser.add_argument('--iterations', type=int, default=50, help='repetitions of each scenario')
+    parser.add_argument('--messages', type=int, default=2000, help='messages in the on_message flood')
+    parser.add_argument('--scenario', action='append', help='run only this scenario, may be repeated')
+    parser.add_argument('--output', help='file the JSON results are written to instead of stdout')
+    args = parser.parse_args()
+    random.seed(0)
+
+    # the bot keeps destiny.db, the manifest mirror and its logs in the working directory, so use a scratch one
+    workdir: str = tempfile.mkdtemp(prefix='xur-bench-')
+    shutil.copy(os.path.join(FIXTURES, 'hate_speech.txt'), workdir)
+    os.chdir(workdir)
+    os.environ.update({'API_KEY': 'benchmark', 'MEMBERSHIP_ID': '1', 'CHARACTER_ID': '2', 'XBOX_LIVE_EMAIL': '',
+                       'DISCORD_TOKEN': '', 'WARM_UP_VENDORS': 'false'})
+    sys.path.insert(0, ROOT)
+
+    fake: FakeBungie = FakeBungie(latency=args.latency)
+    url: str = fake.start()
+    import Vendor
+    Vendor.bungie_client.root = url + '/Platform'
+    Vendor.manifest.content_root = url
+    Vendor.LOCATION_ROOT_PATH = url + '/xur/current.json'
+
+    try:
+        results: dict = asyncio.get_event_loop().run_until_complete(
+            Benchmarks(fake, args.iterations, args.messages).run(args.scenario))
+    finally:
+        fake.stop()
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report: dict = {
+        'commit': commit(),
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'settings': {'latency_s': args.latency, 'iterations': args.iterations, 'messages': args.messages},
+        'results': results,
+    }
+    text: str = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
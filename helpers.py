@@ -1,6 +1,9 @@
+from datetime import datetime, timedelta
 from enum import Enum
+from dateutil import tz
 
 DESTINY_TRACKER = "https://destinytracker.com/destiny-2/db/items/"
+EASTERN = tz.gettz('America/New_York')
 
 
 class Emoji(Enum):
@@ -30,3 +33,47 @@ def hyperlink(item: dict) -> str:
     link = "[" + item['name'] + "]"
     link = link + "(" + DESTINY_TRACKER + str(item['hash']) + ")"
     return link
+
+
+def format_duration(duration: timedelta) -> str:
+    """Spells out a duration to the minute, e.g. '2 days, 5 hours, and 3 minutes'
+
+    :param duration: The duration to spell out
+    :return: str
+    """
+    minutes: int = max(int(duration.total_seconds()) // 60, 0)
+    days, minutes = divmod(minutes, 24 * 60)
+    hours, minutes = divmod(minutes, 60)
+    text: str = f'{hours} hours, and {minutes} minutes'
+    if days:
+        text = f'{days} day{"s" if days > 1 else ""}, ' + text
+    return text
+
+
+def format_eastern(moment: datetime) -> str:
+    """Formats a moment the way players in the bot's home timezone expect, e.g. 'October, 23 2026 at 1pm EDT'
+
+    :param moment: An aware datetime
+    :return: str
+    """
+    local: datetime = moment.astimezone(EASTERN)
+    return f'{local.strftime("%B, %d %Y")} at {local.hour % 12 or 12}{"am" if local.hour < 12 else "pm"} {local.tzname()}'
+
+
+def format_week(week: str) -> str:
+    """Formats a week as named by reset_calendar.week_of, e.g. 'the week of October 13, 2026'
+
+    :param week: The date of the weekly reset that started the week, e.g. '2026-10-13'
+    :return: str
+    """
+    start: datetime = datetime.strptime(week, '%Y-%m-%d')
+    return f'the week of {start.strftime("%B")} {start.day}, {start.year}'
+
+
+def vendor_name(vendor_hash) -> str:
+    """Turns a VendorHash into the name players know the vendor by, e.g. 'Banshee 44'
+
+    :param vendor_hash: A VendorHash
+    :return: str
+    """
+    return vendor_hash.name.replace('_', ' ').title()
@@ -0,0 +1,61 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import discord
+from dotenv import load_dotenv
+
+load_dotenv()
+TOKEN = os.getenv('DISCORD_TOKEN')
+SHARD_COUNT = os.getenv('SHARD_COUNT', 'auto')  # a number, or 'auto' to use as many shards as Discord recommends
+SHARD_PROCESSES: int = int(os.getenv('SHARD_PROCESSES', '2'))
+BOT_PATH: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'xur_bot.py')
+
+
+async def recommended_shard_count() -> int:
+    """Asks Discord how many shards the bot should run with
+
+    :return: int
+    """
+    http: discord.http.HTTPClient = discord.http.HTTPClient()
+    try:
+        await http.static_login(TOKEN, bot=True)
+        shard_count, _ = await http.get_bot_gateway()
+        return shard_count
+    finally:
+        await http.close()
+
+
+def shard_environment(number: int, shard_count: int) -> dict:
+    """Returns the environment the bot process number runs in, with its share of the shards
+
+    :return: dict
+    """
+    env: dict = dict(os.environ, SHARD_COUNT=str(shard_count),
+                     SHARD_IDS=','.join(map(str, range(number, shard_count, SHARD_PROCESSES))))
+    env.setdefault('SHARED_CACHE_PATH', 'shared_cache.db')
+    root, extension = os.path.splitext(os.getenv('ERROR_LOG_PATH', 'err.log'))
+    env['ERROR_LOG_PATH'] = f'{root}.shard{number}{extension}'  # one log per process, each rotated on its own
+    if os.getenv('METRICS_PORT'):  # one port per process
+        env['METRICS_PORT'] = str(int(os.getenv('METRICS_PORT')) + number)
+    return env
+
+
+def main():
+    # Runs SHARD_PROCESSES copies of xur_bot.py, each with its share of the shards, all sharing one vendor cache
+    shard_count: int = asyncio.run(recommended_shard_count()) if SHARD_COUNT == 'auto' else int(SHARD_COUNT)
+    shard_count = max(shard_count, SHARD_PROCESSES)  # every process gets at least one shard
+    print(f'Running {shard_count} shards in {SHARD_PROCESSES} processes')
+    processes: list = [subprocess.Popen([sys.executable, BOT_PATH], env=shard_environment(number, shard_count))
+                       for number in range(SHARD_PROCESSES)]
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == '__main__':
+    main()
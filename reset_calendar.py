@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta, timezone
+
+DAILY_RESET_HOUR: int = 17  # Destiny 2 resets at 17:00 UTC all year round
+WEEKLY_RESET_DAY: int = 1  # Tuesday
+XUR_ARRIVAL_DAY: int = 4  # Friday
+XUR_STAY: timedelta = timedelta(days=4)  # Friday reset until Tuesday reset
+XUR_ABSENCE: timedelta = timedelta(days=3)  # Tuesday reset until Friday reset
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def next_daily_reset(now: datetime = None) -> datetime:
+    """Returns the first daily reset after now
+
+    :param now: (Optional) An aware datetime, defaults to the current time
+    :return: datetime
+    """
+    now = now or utc_now()
+    reset: datetime = now.astimezone(timezone.utc).replace(hour=DAILY_RESET_HOUR, minute=0, second=0, microsecond=0)
+    if reset <= now:
+        reset += timedelta(days=1)
+    return reset
+
+
+def next_weekly_reset(now: datetime = None) -> datetime:
+    """Returns the first weekly reset after now
+
+    :param now: (Optional) An aware datetime, defaults to the current time
+    :return: datetime
+    """
+    reset: datetime = next_daily_reset(now)
+    return reset + timedelta(days=(WEEKLY_RESET_DAY - reset.weekday()) % 7)
+
+
+def week_of(now: datetime = None) -> str:
+    """Names the week now falls in after the weekly reset that started it, e.g. '2026-10-13'
+
+    :param now: (Optional) An aware datetime, defaults to the current time
+    :return: str
+    """
+    return (next_weekly_reset(now) - timedelta(days=7)).date().isoformat()
+
+
+def next_xur_arrival(now: datetime = None) -> datetime:
+    """Returns the first Friday daily reset after now, which is when Xur arrives
+
+    :param now: (Optional) An aware datetime, defaults to the current time
+    :return: datetime
+    """
+    reset: datetime = next_daily_reset(now)
+    return reset + timedelta(days=(XUR_ARRIVAL_DAY - reset.weekday()) % 7)
+
+
+def xur_window(now: datetime = None) -> (datetime, datetime):
+    """Returns Xur's current visit, or his next one if he isn't here
+
+    :param now: (Optional) An aware datetime, defaults to the current time
+    :return: (datetime, datetime) - arrival and departure
+    """
+    now = now or utc_now()
+    arrival: datetime = next_xur_arrival(now) - timedelta(days=7)  # the most recent arrival
+    if now >= arrival + XUR_STAY:
+        arrival += timedelta(days=7)
+    return arrival, arrival + XUR_STAY
+
+
+class XurCalendar:
+    def __init__(self, confirm_every: timedelta = timedelta(hours=6), retry_every: timedelta = timedelta(minutes=30)):
+        """Xur's schedule worked out locally, with a departure time the API confirms every so often
+
+        :param confirm_every: How long a confirmation from the API is trusted for
+        :param retry_every: How long to wait after asking the API before asking again, whether or not it answered
+        """
+        self.confirm_every: timedelta = confirm_every
+        self.retry_every: timedelta = retry_every
+        self.confirmed_departure = None
+        self.confirmed_at = None
+        self.attempted_at = None
+
+    def needs_confirmation(self, now: datetime = None) -> bool:
+        now = now or utc_now()
+        if self.attempted_at is not None and now - self.attempted_at <= self.retry_every:
+            return False
+        return self.confirmed_at is None or now - self.confirmed_at > self.confirm_every
+
+    def attempt(self, now: datetime = None):
+        """Records that the API is being asked to confirm the schedule, so a failing API isn't asked again right away
+
+        :param now: (Optional) An aware datetime, defaults to the current time
+        """
+        self.attempted_at = now or utc_now()
+
+    def confirm(self, next_refresh: datetime, now: datetime = None):
+        """Records the nextRefreshDate the API reports for Xur, which is his next arrival
+
+        :param next_refresh: An aware datetime
+        :param now: (Optional) An aware datetime, defaults to the current time
+        """
+        self.confirmed_departure = next_refresh - XUR_ABSENCE
+        self.confirmed_at = now or utc_now()
+
+    def window(self, now: datetime = None) -> (datetime, datetime):
+        """Returns Xur's current or next visit, preferring the confirmed departure when it belongs to that visit
+
+        :param now: (Optional) An aware datetime, defaults to the current time
+        :return: (datetime, datetime) - arrival and departure
+        """
+        arrival, departure = xur_window(now)
+        if self.confirmed_departure is not None and arrival < self.confirmed_departure < departure + XUR_ABSENCE:
+            departure = self.confirmed_departure
+        return arrival, departure
+
+    def is_present(self, now: datetime = None) -> bool:
+        now = now or utc_now()
+        arrival, departure = self.window(now)
+        return arrival <= now < departure
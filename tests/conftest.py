@@ -0,0 +1,43 @@
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class Clock:
+    def __init__(self, now: datetime):
+        """Stands in for reset_calendar.utc_now, the time only moves when a test moves it
+
+        :param now: The time to start at
+        """
+        self.now: datetime = now
+
+    def __call__(self) -> datetime:
+        return self.now
+
+    def advance(self, **kwargs):
+        self.now += timedelta(**kwargs)
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    """Fakes utc_now everywhere the caches and the calendar read it, starting on a Wednesday"""
+    import HTTPCache
+    import ResponseCache
+    import reset_calendar
+    fake: Clock = Clock(datetime(2026, 10, 14, 12, tzinfo=timezone.utc))
+    for module in (HTTPCache, ResponseCache, reset_calendar):
+        monkeypatch.setattr(module, 'utc_now', fake)
+    return fake
+
+
+@pytest.fixture
+def errors(monkeypatch) -> list:
+    """Collects what would have been written to err.log instead of writing it"""
+    from ErrorLog import error_log
+    recorded: list = []
+    monkeypatch.setattr(error_log, 'record', lambda event, exc_info=None, **context: recorded.append((event, exc_info)))
+    return recorded
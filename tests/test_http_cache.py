@@ -0,0 +1,102 @@
+import asyncio
+from datetime import timedelta
+
+import aiohttp
+import pytest
+
+from HTTPCache import HTTPCache
+
+URL: str = 'https://example.com/current.json'
+
+
+class FakeSite:
+    def __init__(self):
+        """Answers like a site serving one document, until it is told to go down"""
+        self.document: dict = {'locationName': 'Tower'}
+        self.etag: str = '"1"'
+        self.down: bool = False
+        self.requests: list = []
+
+    async def fetch(self, url: str, headers: dict = None, source: str = 'external', timeout: float = None):
+        self.requests.append(dict(headers or {}))
+        if self.down:
+            raise asyncio.TimeoutError()
+        if (headers or {}).get('If-None-Match') == self.etag:
+            return 304, {'Cache-Control': 'max-age=60'}, None
+        return 200, {'Cache-Control': 'max-age=60', 'ETag': self.etag}, self.document
+
+
+def get(cache: HTTPCache) -> dict:
+    return asyncio.run(cache.get_json(URL))
+
+
+def test_fresh_document_is_reused_without_asking(clock):
+    site: FakeSite = FakeSite()
+    cache: HTTPCache = HTTPCache(site)
+    assert get(cache) == {'locationName': 'Tower'}
+    clock.advance(seconds=59)
+    assert get(cache) == {'locationName': 'Tower'}
+    assert len(site.requests) == 1
+
+
+def test_expired_document_is_revalidated_with_its_etag(clock):
+    site: FakeSite = FakeSite()
+    cache: HTTPCache = HTTPCache(site)
+    get(cache)
+    clock.advance(seconds=60)
+    assert get(cache) == {'locationName': 'Tower'}
+    assert site.requests[-1] == {'If-None-Match': '"1"'}
+    clock.advance(seconds=59)  # the 304 made it fresh for another max-age
+    get(cache)
+    assert len(site.requests) == 2
+
+    site.document, site.etag = {'locationName': 'EDZ'}, '"2"'
+    clock.advance(seconds=1)
+    assert get(cache) == {'locationName': 'EDZ'}
+
+
+def test_site_down_serves_the_last_copy_without_asking_until_retry_after(clock):
+    site: FakeSite = FakeSite()
+    cache: HTTPCache = HTTPCache(site, retry_after=timedelta(minutes=1))
+    get(cache)
+    site.down = True
+    clock.advance(seconds=60)
+    for _ in range(3):
+        assert get(cache) == {'locationName': 'Tower'}
+    assert len(site.requests) == 2
+
+    clock.advance(minutes=1, seconds=1)
+    site.down = False
+    assert get(cache) == {'locationName': 'Tower'}
+    assert len(site.requests) == 3
+
+
+def test_site_down_without_a_copy_raises(clock):
+    site: FakeSite = FakeSite()
+    site.down = True
+    with pytest.raises(asyncio.TimeoutError):
+        get(HTTPCache(site))
+
+
+def test_error_status_without_a_copy_raises(clock):
+    class BrokenSite(FakeSite):
+        async def fetch(self, url: str, headers: dict = None, source: str = 'external', timeout: float = None):
+            return 500, {}, None
+    with pytest.raises(aiohttp.ClientError):
+        get(HTTPCache(BrokenSite()))
+
+
+def test_saves_leave_purging_expired_entries_to_the_response_cache(clock):
+    class Store:
+        def __init__(self):
+            self.saved: list = []
+
+        async def load(self, key: str):
+            return None
+
+        def save(self, key: str, value, expires_at, now=None):
+            self.saved.append((key, expires_at, now))
+
+    store: Store = Store()
+    get(HTTPCache(FakeSite(), keep_for=timedelta(days=7), store=store))
+    assert store.saved == [(f'http.{URL}', clock.now + timedelta(seconds=60, days=7), None)]
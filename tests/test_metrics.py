@@ -0,0 +1,9 @@
+from Metrics import Metrics
+
+
+def test_label_values_and_help_are_escaped():
+    metrics: Metrics = Metrics()
+    metrics.counter('commands_total', 'Commands\nrun', command='say "hi" \\ bye\n').inc()
+    lines: list = metrics.render().splitlines()
+    assert lines[0].endswith(' Commands\\nrun')
+    assert lines[2].endswith('{command="say \\"hi\\" \\\\ bye\\n"} 1')
@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+import pytest
+
+from RequestScheduler import background, priority, Priority, RequestRejected, RequestScheduler
+
+
+def test_burst_goes_through_at_once_and_the_rest_at_the_rate():
+    async def scenario() -> (float, float):
+        scheduler: RequestScheduler = RequestScheduler(rate=20, burst=5)
+        began: float = time.perf_counter()
+        for _ in range(5):
+            await scheduler.turn()
+        burst: float = time.perf_counter() - began
+        for _ in range(4):
+            await scheduler.turn()
+        return burst, time.perf_counter() - began
+    burst, total = asyncio.run(scenario())
+    assert burst < 0.05
+    assert 0.19 <= total < 0.5
+
+
+def test_waiting_requests_go_by_priority_then_arrival():
+    async def scenario() -> list:
+        scheduler: RequestScheduler = RequestScheduler(rate=100, burst=1)
+        await scheduler.turn()  # uses up the burst, so the rest have to wait
+        order: list = []
+
+        async def request(name: str, request_priority: Priority):
+            await scheduler.turn(request_priority)
+            order.append(name)
+        await asyncio.gather(request('background 1', Priority.BACKGROUND), request('user 1', Priority.USER),
+                             request('background 2', Priority.BACKGROUND), request('user 2', Priority.USER))
+        return order
+    assert asyncio.run(scenario()) == ['user 1', 'user 2', 'background 1', 'background 2']
+
+
+def test_requests_inherit_the_priority_of_their_context():
+    async def current() -> Priority:
+        return priority.get()
+
+    async def scenario() -> Priority:
+        with background():
+            task: asyncio.Future = asyncio.ensure_future(current())
+        return await task
+    assert asyncio.run(scenario()) is Priority.BACKGROUND
+    assert priority.get() is Priority.USER
+
+
+def test_backoff_holds_every_request():
+    async def scenario() -> float:
+        scheduler: RequestScheduler = RequestScheduler()
+        scheduler.backoff(0.2)
+        began: float = time.perf_counter()
+        await scheduler.turn()
+        return time.perf_counter() - began
+    assert asyncio.run(scenario()) >= 0.19
+
+
+def test_request_waiting_too_long_is_rejected():
+    async def scenario():
+        scheduler: RequestScheduler = RequestScheduler(rate=0.01, burst=1, queue_timeout=0.05)
+        await scheduler.turn()
+        await scheduler.turn()
+    with pytest.raises(RequestRejected) as rejected:
+        asyncio.run(scenario())
+    assert rejected.value.reason == 'timeout'
+
+
+def test_full_queue_evicts_background_work_for_a_user():
+    async def scenario():
+        scheduler: RequestScheduler = RequestScheduler(rate=0.01, burst=1, max_queue=1)
+        await scheduler.turn()
+        waiting = asyncio.ensure_future(scheduler.turn(Priority.BACKGROUND))
+        await asyncio.sleep(0)
+        user = asyncio.ensure_future(scheduler.turn(Priority.USER))
+        with pytest.raises(RequestRejected) as evicted:
+            await waiting
+        assert evicted.value.reason == 'queue_full'
+
+        with pytest.raises(RequestRejected) as rejected:  # nothing of a lower priority left to evict
+            await scheduler.turn(Priority.USER)
+        assert rejected.value.reason == 'queue_full'
+        user.cancel()
+    asyncio.run(scenario())
+
+
+def test_request_evicted_as_its_wait_runs_out_is_not_let_through():
+    async def scenario():
+        loop = asyncio.get_event_loop()
+        scheduler: RequestScheduler = RequestScheduler(rate=0.01, burst=1, max_queue=1, queue_timeout=0.05)
+        await scheduler.turn()
+        # the loop is held up past both the timeout and the eviction, so they run one right after the other
+        loop.call_later(0.01, time.sleep, 0.1)
+        loop.call_later(0.06, scheduler._make_room, Priority.USER)
+        await scheduler.turn(Priority.BACKGROUND)
+    with pytest.raises(RequestRejected) as rejected:
+        asyncio.run(scenario())
+    assert rejected.value.reason == 'queue_full'
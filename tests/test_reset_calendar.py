@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta, timezone
+
+from reset_calendar import next_daily_reset, next_weekly_reset, next_xur_arrival, week_of, xur_window, XurCalendar
+
+# a Wednesday, between Tuesday's weekly reset and Xur's arrival on Friday
+WEDNESDAY: datetime = datetime(2026, 10, 14, 12, tzinfo=timezone.utc)
+FRIDAY_RESET: datetime = datetime(2026, 10, 16, 17, tzinfo=timezone.utc)
+TUESDAY_RESET: datetime = datetime(2026, 10, 20, 17, tzinfo=timezone.utc)
+
+
+def test_next_daily_reset_is_today_before_17_and_tomorrow_from_17():
+    assert next_daily_reset(WEDNESDAY) == datetime(2026, 10, 14, 17, tzinfo=timezone.utc)
+    assert next_daily_reset(WEDNESDAY.replace(hour=17)) == datetime(2026, 10, 15, 17, tzinfo=timezone.utc)
+
+
+def test_next_weekly_reset_is_the_next_tuesday_reset():
+    assert next_weekly_reset(WEDNESDAY) == TUESDAY_RESET
+    assert next_weekly_reset(TUESDAY_RESET - timedelta(seconds=1)) == TUESDAY_RESET
+    assert next_weekly_reset(TUESDAY_RESET) == TUESDAY_RESET + timedelta(days=7)
+    assert week_of(WEDNESDAY) == '2026-10-13'
+
+
+def test_xur_window_before_during_and_after_a_visit():
+    assert next_xur_arrival(WEDNESDAY) == FRIDAY_RESET
+    assert xur_window(WEDNESDAY) == (FRIDAY_RESET, TUESDAY_RESET)
+    assert xur_window(FRIDAY_RESET) == (FRIDAY_RESET, TUESDAY_RESET)
+    assert xur_window(TUESDAY_RESET - timedelta(seconds=1)) == (FRIDAY_RESET, TUESDAY_RESET)
+    assert xur_window(TUESDAY_RESET) == (FRIDAY_RESET + timedelta(days=7), TUESDAY_RESET + timedelta(days=7))
+
+
+def test_is_present_only_between_arrival_and_departure():
+    calendar: XurCalendar = XurCalendar()
+    assert not calendar.is_present(WEDNESDAY)
+    assert calendar.is_present(FRIDAY_RESET)
+    assert not calendar.is_present(TUESDAY_RESET)
+
+
+def test_confirmed_departure_replaces_the_worked_out_one_for_its_visit_only():
+    calendar: XurCalendar = XurCalendar()
+    calendar.confirm(TUESDAY_RESET + timedelta(days=3) - timedelta(hours=1), now=FRIDAY_RESET)
+    assert calendar.window(FRIDAY_RESET) == (FRIDAY_RESET, TUESDAY_RESET - timedelta(hours=1))
+    next_visit: datetime = FRIDAY_RESET + timedelta(days=7)
+    assert calendar.window(next_visit) == (next_visit, TUESDAY_RESET + timedelta(days=7))
+
+
+def test_confirmation_is_trusted_for_confirm_every():
+    calendar: XurCalendar = XurCalendar(confirm_every=timedelta(hours=6), retry_every=timedelta(minutes=30))
+    assert calendar.needs_confirmation(WEDNESDAY)
+    calendar.attempt(WEDNESDAY)
+    calendar.confirm(FRIDAY_RESET, now=WEDNESDAY)
+    assert not calendar.needs_confirmation(WEDNESDAY + timedelta(hours=6))
+    assert calendar.needs_confirmation(WEDNESDAY + timedelta(hours=6, seconds=1))
+
+
+def test_failed_confirmation_is_retried_after_retry_every():
+    calendar: XurCalendar = XurCalendar(confirm_every=timedelta(hours=6), retry_every=timedelta(minutes=30))
+    calendar.attempt(WEDNESDAY)  # and the API never answered
+    assert not calendar.needs_confirmation(WEDNESDAY + timedelta(minutes=30))
+    assert calendar.needs_confirmation(WEDNESDAY + timedelta(minutes=30, seconds=1))
@@ -0,0 +1,151 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+from RequestScheduler import priority, Priority
+from ResponseCache import ResponseCache
+
+
+class Upstream:
+    def __init__(self):
+        """Counts the fetches it answers and the priority each was made at"""
+        self.fetches: list = []
+
+    async def fetch(self) -> int:
+        self.fetches.append(priority.get())
+        await asyncio.sleep(0)
+        return len(self.fetches)
+
+
+def test_stale_entry_is_refreshed_in_the_background(clock):
+    upstream: Upstream = Upstream()
+    cache: ResponseCache = ResponseCache(stale_for=timedelta(minutes=5))
+
+    async def scenario():
+        assert await cache.get('sales', upstream.fetch, clock.now + timedelta(hours=1)) == 1
+        clock.advance(hours=1, minutes=1)
+        assert await cache.get('sales', upstream.fetch, clock.now + timedelta(days=1)) == 1
+        await cache._in_flight['sales']
+        assert await cache.get('sales', upstream.fetch, clock.now + timedelta(days=1)) == 2
+    asyncio.run(scenario())
+    assert upstream.fetches == [Priority.USER, Priority.BACKGROUND]
+
+
+class Store:
+    def __init__(self):
+        """Keeps saved entries in memory the way a Snapshot keeps them on disk"""
+        self.entries: dict = {}
+        self.purged_before: list = []
+
+    async def load(self, key: str):
+        return self.entries.get(key)
+
+    def save(self, key: str, value, expires_at, now=None):
+        self.entries[key] = (value, expires_at)
+        self.purged_before.append(now)
+
+    async def coalesce(self, key: str, fetch, is_current):
+        return await fetch()
+
+
+def test_concurrent_misses_share_one_fetch(clock):
+    upstream: Upstream = Upstream()
+    cache: ResponseCache = ResponseCache()
+
+    async def scenario() -> list:
+        return await asyncio.gather(*(cache.get('sales', upstream.fetch, clock.now + timedelta(hours=1))
+                                      for _ in range(10)))
+    assert asyncio.run(scenario()) == [1] * 10
+    assert len(upstream.fetches) == 1
+
+
+def test_entry_is_reused_until_it_expires(clock):
+    upstream: Upstream = Upstream()
+    cache: ResponseCache = ResponseCache(stale_for=timedelta(minutes=5))
+
+    async def get() -> int:
+        return await cache.get('sales', upstream.fetch, clock.now + timedelta(hours=1))
+    assert asyncio.run(get()) == 1
+    clock.advance(minutes=59)
+    assert asyncio.run(get()) == 1
+    clock.advance(hours=1, minutes=6)  # past the stale window as well
+    assert asyncio.run(get()) == 2
+
+
+def test_stale_entry_is_not_served_when_not_allowed(clock):
+    upstream: Upstream = Upstream()
+    cache: ResponseCache = ResponseCache(stale_for=timedelta(minutes=5))
+
+    async def get() -> int:
+        return await cache.get('sales', upstream.fetch, clock.now + timedelta(hours=1), allow_stale=False)
+    asyncio.run(get())
+    clock.advance(hours=1, minutes=1)
+    assert asyncio.run(get()) == 2
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    upstream: Upstream = Upstream()
+    cache: ResponseCache = ResponseCache(max_size=2)
+
+    async def get(key: str) -> int:
+        return await cache.get(key, upstream.fetch, clock.now + timedelta(hours=1))
+
+    async def scenario():
+        await get('a')
+        await get('b')
+        await get('a')
+        await get('c')  # evicts b, which was used last longest ago
+        assert await get('a') == 1
+        assert await get('b') == 4
+    asyncio.run(scenario())
+
+
+def test_entries_are_saved_to_and_restored_from_the_store(clock):
+    upstream: Upstream = Upstream()
+    store: Store = Store()
+    expires_at = clock.now + timedelta(hours=1)
+    asyncio.run(ResponseCache(store=store, stale_for=timedelta(minutes=5)).get('sales', upstream.fetch, expires_at))
+    assert store.entries == {'sales': (1, expires_at)}
+    assert store.purged_before == [clock.now - timedelta(minutes=5)]
+
+    restarted: ResponseCache = ResponseCache(store=store)
+    assert asyncio.run(restarted.get('sales', upstream.fetch, expires_at)) == 1
+    assert len(upstream.fetches) == 1
+
+
+def test_forced_refresh_starts_after_the_running_fetch(clock):
+    started: list = []
+
+    async def fetch(name: str) -> str:
+        started.append(name)
+        await asyncio.sleep(0.01)
+        return name
+
+    async def scenario():
+        cache: ResponseCache = ResponseCache(store=Store())
+        expires_at = clock.now + timedelta(hours=1)
+        running = cache.refresh('sales', lambda: fetch('user'), expires_at)
+        forced = cache.refresh('sales', lambda: fetch('forced'), expires_at, force=True)
+        assert cache.refresh('sales', lambda: fetch('joined'), expires_at, force=True) is forced
+        assert await running == 'user'
+        assert await forced == 'forced'
+        assert await cache.get('sales', lambda: fetch('miss'), expires_at) == 'forced'
+    asyncio.run(scenario())
+    assert started == ['user', 'forced']
+
+
+def test_failed_fetch_is_not_cached(clock):
+    calls: list = []
+
+    async def fetch() -> int:
+        calls.append(None)
+        if len(calls) == 1:
+            raise RuntimeError('Bungie.NET is down')
+        return len(calls)
+
+    cache: ResponseCache = ResponseCache()
+    expires_at = clock.now + timedelta(hours=1)
+    with pytest.raises(RuntimeError):
+        asyncio.run(cache.get('sales', fetch, expires_at))
+    assert asyncio.run(cache.get('sales', fetch, expires_at)) == 2
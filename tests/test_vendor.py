@@ -0,0 +1,30 @@
+import asyncio
+
+from BungieClient import BungieAPIError
+
+
+def test_failing_confirmation_is_asked_for_once(monkeypatch, clock, errors):
+    monkeypatch.setenv('MEMBERSHIP_ID', '1')
+    monkeypatch.setenv('CHARACTER_ID', '2')
+    import Vendor
+    monkeypatch.setattr(Vendor, 'utc_now', clock)
+    requests: list = []
+
+    async def get_vendor(**kwargs):
+        requests.append(kwargs)
+        raise BungieAPIError('Bungie.NET is down', status=503)
+    monkeypatch.setattr(Vendor.bungie_client, 'get_vendor', get_vendor)
+
+    async def ask():
+        xur = Vendor.Xur('XUR')
+        for _ in range(10):  # Xur is away on a Wednesday, so these never need anything else from the API
+            assert isinstance(await xur.message(), str)
+            await asyncio.sleep(0)
+        await xur._confirmation
+        clock.advance(minutes=31)
+        await xur.message()
+        await xur._confirmation
+    asyncio.run(ask())
+
+    assert len(requests) == 2
+    assert [event for event, _ in errors] == ['xur_schedule', 'xur_schedule']
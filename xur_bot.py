@@ -1,30 +1,72 @@
+import asyncio
 import os
 import random
-from datetime import datetime
-import better_profanity
+import sys
+from time import perf_counter
 from discord.ext import commands
 from dotenv import load_dotenv
-from Vendor import Vendor
+from BungieClient import BungieAPIError
+from ErrorLog import error_log
+from MessageClassifier import MessageClassifier, Category
+from MessagePipeline import MessagePipeline
+from Metrics import metrics
+from RequestScheduler import background
+from ResetScheduler import ResetScheduler
+from SharedStore import SharedStore
+from Vendor import Vendor, auth, manifest, database, snapshot
 from VendorDictionary import VendorDictionary
 from xur_quotes import who_is_xur, who_are_the_nine, bad_word, bad_word_at_xur
-from helpers import Emoji
+from helpers import Emoji, format_week, vendor_name
+from pybungie import VendorHash
 
-regular_profanity = better_profanity.Profanity()
-hate_speech_check = better_profanity.Profanity()
-hate_speech_check.load_censor_words_from_file('hate_speech.txt')
+classifier = MessageClassifier(hate_speech_file='hate_speech.txt')
 
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 GUILD = os.getenv('DISCORD_GUILD')
+pipeline = MessagePipeline(workers=int(os.getenv('MESSAGE_WORKERS', '4')))
 Xur = Vendor(name='Xur')
 Vendor_Dictionary = VendorDictionary()
-client = commands.Bot(command_prefix="!")
+reset_scheduler = ResetScheduler(xur=Xur, vendors=Vendor_Dictionary)
+SHARD_COUNT = os.getenv('SHARD_COUNT')  # a number, or 'auto' to use as many shards as Discord recommends
+SHARD_IDS = os.getenv('SHARD_IDS')  # e.g. '0,1', the shards this process runs out of SHARD_COUNT
+if SHARD_IDS and (not SHARD_COUNT or SHARD_COUNT == 'auto'):
+    raise RuntimeError('SHARD_IDS only says which shards this process runs, SHARD_COUNT must also be set to the '
+                       'number of shards across every process')
+if SHARD_COUNT or SHARD_IDS:
+    client = commands.AutoShardedBot(
+        command_prefix="!", shard_count=int(SHARD_COUNT) if SHARD_COUNT and SHARD_COUNT != 'auto' else None,
+        shard_ids=[int(shard_id) for shard_id in SHARD_IDS.split(',')] if SHARD_IDS else None)
+else:
+    client = commands.Bot(command_prefix="!")
+upkeep_task = None
+HISTORY_PAGE_SIZE: int = 10
+BUNGIE_UNAVAILABLE: str = "*The Nine are not answering right now*\nBungie.NET is busy or down, try again shortly"
+category_counters: list = [(flag.value, metrics.counter('messages_total', 'Messages by category',
+                                                        category=flag.name.lower())) for flag in Category if flag.value]
 
 
 @client.event
 async def on_command_error(ctx, error):
     if isinstance(error, commands.CommandNotFound):
         await ctx.send("I do not understand")
+    elif isinstance(error, commands.CheckFailure):
+        await ctx.send("Only administrators may ask that of me")
+    elif isinstance(error, commands.CommandInvokeError):
+        error = error.original
+        error_log.record('command', exc_info=error, Server=ctx.guild,
+                         Channel=ctx.channel, User=ctx.author, Command=ctx.message.content)
+
+
+@client.before_invoke
+async def start_timer(ctx):
+    ctx.started = perf_counter()
+
+
+@client.after_invoke
+async def stop_timer(ctx):  # runs whether or not the command succeeded
+    metrics.histogram('command_seconds', 'Time taken to answer each command', command=ctx.command.name).observe(
+        perf_counter() - ctx.started)
 
 
 @client.command()
@@ -32,7 +74,11 @@ async def xur(ctx):
     # Sends an embedded message containing Xur's current inventory, or if he
     # is not currently present, returns a message telling the user when he'll arrive next
     await client.wait_until_ready()
-    message = Xur.message()
+    try:
+        message = await Xur.message()
+    except BungieAPIError:
+        await ctx.send(BUNGIE_UNAVAILABLE)
+        return
     if Xur.embedded:
         await ctx.send(embed=message)
     else:
@@ -49,15 +95,138 @@ async def bounties(ctx, *args):
     try:
         vendor = Vendor_Dictionary.search(name=" ".join(args[:]))
         await client.wait_until_ready()
-        await ctx.send(embed=vendor.message())
+        await ctx.send(embed=await vendor.message())
     except (RuntimeError, AttributeError):
         await client.wait_until_ready()
         await ctx.send("That vendor does not exist in my files or doesn't sell bounties")
+    except BungieAPIError:
+        await ctx.send(BUNGIE_UNAVAILABLE)
+
+
+def split_page(args: tuple) -> (str, int):
+    # a trailing number is the page the user wants, everything before it is the item's name
+    if len(args) > 1 and args[-1].isdigit():
+        return " ".join(args[:-1]), max(int(args[-1]), 1)
+    return " ".join(args), 1
+
+
+@client.command()
+async def lastsold(ctx, *args):
+    # Sends the most recent week the named item was sold by Xur or any other vendor
+    if len(args) == 0:
+        await ctx.send("\!lastsold requires an argument '[item_name]', try \!lastsold Gjallarhorn")
+        return
+    row = await database.last_sold(" ".join(args))
+    if row is None:
+        await ctx.send("I have no record of that item ever being sold")
+        return
+    await ctx.send(f'{vendor_name(VendorHash(row["vendor"]))} last sold **{row["name"]}** ({row["item_type"]}) '
+                   f'{format_week(row["week"])}')
+
+
+@client.command()
+async def appearances(ctx, *args):
+    # Sends every week the named item was sold, HISTORY_PAGE_SIZE weeks at a time
+    if len(args) == 0:
+        await ctx.send("\!appearances requires an argument '[item_name] [page]', try \!appearances Gjallarhorn 2")
+        return
+    name, page = split_page(args)
+    result = await database.appearances(name, page=page, per_page=HISTORY_PAGE_SIZE)
+    if result is None:
+        await ctx.send("I have no record of that item ever being sold")
+        return
+    pages = max(1, -(-result['total'] // HISTORY_PAGE_SIZE))
+    lines = [f'**{result["item"]["name"]}** has been sold {result["total"]} time{"s" if result["total"] != 1 else ""}']
+    lines += [f'• {format_week(row["week"])} by {vendor_name(VendorHash(row["vendor"]))}' for row in result['rows']]
+    lines.append(f'Page {page} of {pages}' if result['rows'] else f'Page {page} is past the last page, {pages}')
+    if result['others']:
+        lines.append('Also matching: ' + ', '.join(other['name'] for other in result['others'][:5]))
+    await ctx.send('\n'.join(lines))
+
+
+@client.command()
+async def history(ctx, class_name: str = '', page: str = '1'):
+    # Sends what Xur sold for a class (titan, hunter, warlock or weapon), most recent week first
+    class_type = {'TITAN': 'TITAN', 'HUNTER': 'HUNTER', 'WARLOCK': 'WARLOCK', 'WEAPON': 'UNKNOWN'}.get(
+        class_name.upper())
+    if class_type is None or not page.isdigit():
+        await ctx.send("\!history requires an argument '[titan|hunter|warlock|weapon] [page]', try \!history titan")
+        return
+    page = max(int(page), 1)
+    total, rows = await database.sold_by(Xur.hash_id.value, class_type, page=page, per_page=HISTORY_PAGE_SIZE)
+    if not total:
+        await ctx.send("I have no record of selling anything like that")
+        return
+    pages = -(-total // HISTORY_PAGE_SIZE)
+    lines = [f'• {format_week(row["week"])}: **{row["name"]}** ({row["item_type"]})' for row in rows]
+    lines.append(f'Page {page} of {pages}' if rows else f'Page {page} is past the last page, {pages}')
+    await ctx.send('\n'.join(lines))
+
+
+@client.command()
+@commands.has_permissions(administrator=True)
+async def stats(ctx):
+    # Sends the latency, request, cache and event loop metrics recorded since the bot started
+    lines: list = metrics.summary()
+    lookups: dict = {}
+    for labels, counter in metrics.family('cache_requests_total').items():
+        labels = dict(labels)
+        found = lookups.setdefault(f'{labels["cache"]}.{labels["key"]}', [0, 0])
+        found[0] += counter.value if labels['result'] != 'miss' else 0
+        found[1] += counter.value
+    lines += [f'cache_hit_rate{{key="{key}"}} {hits / total:.1%}' for key, (hits, total) in sorted(lookups.items())]
+
+    chunk: str = ''
+    for line in lines or ['Nothing has been recorded yet']:
+        if len(chunk) + len(line) > 1900:  # stay under Discord's 2000 character limit
+            await ctx.send(f'```{chunk}```')
+            chunk = ''
+        chunk += line + '\n'
+    await ctx.send(f'```{chunk}```')
 
 
 @client.event
 async def on_ready():  # Confirmation in the terminal to let you know the bot has activated successfully
+    global upkeep_task
     print(f'{client.user.name} has connected to Discord!')
+    shared: bool = isinstance(snapshot, SharedStore)
+    manifest.start(follow=shared)
+    metrics.start()
+    if os.getenv('WARM_UP_VENDORS', 'true').lower() == 'true':
+        asyncio.ensure_future(warm_up(wait_for_manifest=shared))
+    if shared:  # only the process holding the lease refreshes, the others read the cache and the tokens file
+        if upkeep_task is None:
+            auth.renews = False
+            upkeep_task = asyncio.ensure_future(snapshot.lead('upkeep', upkeep))
+    else:
+        auth.start()
+        if os.getenv('REFRESH_AT_RESET', 'true').lower() == 'true':
+            reset_scheduler.start()
+
+
+async def warm_up(wait_for_manifest: bool):
+    # Another process may still be installing the manifest, the vendors would otherwise be read from the API
+    if wait_for_manifest:
+        await manifest.installed()
+    await Vendor_Dictionary.warm_up()
+
+
+async def upkeep():
+    # Keeps the manifest and access token fresh and refreshes the vendors at every reset, for every process sharing
+    # the cache
+    with background():
+        jobs: list = [asyncio.ensure_future(manifest.keep_synced())]
+    if auth.configured:
+        jobs.append(asyncio.ensure_future(auth.keep_fresh()))
+    if os.getenv('REFRESH_AT_RESET', 'true').lower() == 'true':
+        jobs.append(asyncio.ensure_future(reset_scheduler.run()))
+    auth.renews = True
+    try:
+        await asyncio.gather(*jobs)
+    finally:
+        auth.renews = False
+        for job in jobs:
+            job.cancel()
 
 
 @client.event
@@ -65,50 +234,45 @@ async def on_message(message):
     # if the message is from xur_bot, ignore it
     if message.author == client.user:
         return
+    with metrics.histogram('on_message_seconds', 'Time taken to handle each message').time():
+        await handle_message(message)
+
+
+async def handle_message(message):
     # Check what kind of message it is
-    if (
-            ('who is xur' in message.content.lower()) |
-            ('what is xur' in message.content.lower())
-    ):
-        response = random.choice(who_is_xur)
-        await message.channel.send(response)
-    elif hate_speech_check.contains_profanity(message.content):
-        await message.channel.purge(limit=1)
-
-    elif (
-            (regular_profanity.contains_profanity(message.content)) |
-            ('i\'m salty' in message.content.lower()) |
-            ('im salty' in message.content.lower()) |
-            ('i am salty' in message.content.lower())
-    ):
-        if 'xur' in message.content.lower():
-            await message.add_reaction(emoji=Emoji.ULDREN_THUMBS_DOWN.value)
-            response = random.choice(bad_word_at_xur)
+    category = classifier.classify(message.content)
+    for flag, counter in category_counters:
+        if flag & category.value:
+            counter.inc()
+    # only classification happens here, the responses are carried out by the pipeline
+    if category & Category.WHO_IS_XUR:
+        pipeline.reply(message.channel, random.choice(who_is_xur), key='who_is_xur')
+    elif category & Category.HATE_SPEECH:
+        pipeline.moderate(message)
+
+    elif category & (Category.PROFANITY | Category.SALTY):
+        if category & Category.MENTIONS_XUR:
+            pipeline.react(message, Emoji.ULDREN_THUMBS_DOWN.value)
+            pipeline.reply(message.channel, random.choice(bad_word_at_xur), key='bad_word_at_xur')
         else:
-            response = random.choice(bad_word)
-        await message.channel.send(response)
-
-    elif (
-            ('who are the nine' in message.content.lower()) |
-            ('what are the nine' in message.content.lower()) |
-            ('who is the nine' in message.content.lower()) |
-            ('what is the nine' in message.content.lower())
-    ):
-        response = random.choice(who_are_the_nine)
-        await message.channel.send(response)
+            pipeline.reply(message.channel, random.choice(bad_word), key='bad_word')
+
+    elif category & Category.WHO_ARE_THE_NINE:
+        pipeline.reply(message.channel, random.choice(who_are_the_nine), key='who_are_the_nine')
 
     await client.process_commands(message)
 
 
 @client.event
 async def on_error(event, *args, **kwargs):
-    with open('err.log', 'a') as f:
-        if event == 'on_message':
-            message = args[0]
-            f.write(
-                f'\nERROR on {datetime.now().strftime("%m/%d/%Y at %H:%M:%S")}\nServer: {message.guild}\nChannel: {message.channel}\nUser: {message.author}\nUnhandled message: {message.content}\n')
-        else:
-            raise
+    # Records every unhandled error, the writing happens on the error log's own thread
+    context = {}
+    if event == 'on_message' and args:
+        message = args[0]
+        context = {'Server': message.guild, 'Channel': message.channel, 'User': message.author,
+                   'Unhandled message': message.content}
+    error_log.record(event, exc_info=sys.exc_info(), **context)
 
 
-client.run(TOKEN)
+if __name__ == '__main__':
+    client.run(TOKEN)
@@ -26,3 +26,12 @@ who_are_the_nine = [
     '*I cannot explain what the Nine are. They are... very large. I cannot explain. The fault is mine, not yours.*',
     '*I do mean to explain, but every time I try, I lose the thread.*'
 ]
+
+# phrases each group of quotes is a response to, matched anywhere in a lower case message
+who_is_xur_triggers = ['who is xur', 'what is xur']
+
+salty_triggers = ['i\'m salty', 'im salty', 'i am salty']
+
+who_are_the_nine_triggers = ['who are the nine', 'what are the nine', 'who is the nine', 'what is the nine']
+
+mentions_xur_triggers = ['xur']